@@ -22,7 +22,7 @@
 #    distribution.
 #
 
-__all__ = ['config', 'mixer', 'gui']
+__all__ = ['config', 'mixer', 'gui', 'trace', 'statuspage']
 
 __author__ = 'epinull <epinull@gmail.com>'
 __version__ = '0.1'
@@ -0,0 +1,336 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+# End-to-end hotkey latency benchmark.
+#
+# Starts a private Xvfb, runs the real Main and HotKeyListener against a
+# simulated mixer, injects key presses through XTest and measures how long
+# each press takes to turn into a write to the (simulated) device:
+#
+#   python -m pyvolwheel.bench [--rate 30] [--count 500] [--mode tap|hold]
+#
+# Needs Xvfb and python-xlib (with the XTEST extension).
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+from optparse import OptionParser
+import gobject
+from pyvolwheel import mixer, config
+
+class _SimHandle(object):
+    # Stands in for the driver's mixer object
+    def close(self):
+        pass
+
+class SimMixer(mixer.Mixer):
+    """A mixer that only exists in memory and logs every write
+
+    latency is how long each call takes, to stand in for slow devices.
+    With log set to False writes aren't kept, so long runs don't grow.
+    """
+    def __init__(self, control='Sim', latency=0.0, log=True):
+        mixer.Mixer.__init__(self)
+        self._control = control
+        self._levels = [50, 50]
+        self._muted = False
+        self.latency = latency
+        self.log = log
+        self.calls = 0
+        # (time, delta) of every volume change
+        self.writes = []
+        self._lock = threading.Lock()
+        self._mixer = _SimHandle()
+
+    def _device_call(self):
+        self.calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def get_device(self):
+        return 'sim'
+
+    def get_control(self):
+        return self._control
+
+    def get_volume(self):
+        self._check_mixer()
+        self._device_call()
+        return [mixer._clamp(l) for l in self._levels]
+
+    def set_volume(self, volume):
+        self.set_channels((volume, volume))
+
+    def set_channels(self, levels):
+        self._check_mixer()
+        self._device_call()
+        with self._lock:
+            if self.log is True:
+                self.writes.append((time.time(), levels[0] - self._levels[0]))
+            self._levels = list(levels)
+
+    def change_volume(self, delta):
+        self._check_mixer()
+        self._device_call()
+        with self._lock:
+            if self.log is True:
+                self.writes.append((time.time(), delta))
+            # Not clamped, so long runs in one direction still count
+            self._levels = [l + delta for l in self._levels]
+
+    def get_mute(self):
+        self._check_mixer()
+        return self._muted
+
+    def set_mute(self, flag):
+        self._check_mixer()
+        self._device_call()
+        self._muted = flag
+
+def start_xvfb(timeout=10):
+    """Start Xvfb on a free display, returning (process, display name)"""
+    for n in range(99, 300):
+        if not (os.path.exists('/tmp/.X{0}-lock'.format(n)) or
+                os.path.exists('/tmp/.X11-unix/X{0}'.format(n))):
+            break
+    name = ':{0}'.format(n)
+    devnull = open(os.devnull, 'w')
+    proc = subprocess.Popen(['Xvfb', name, '-screen', '0', '640x480x24',
+                             '-nolisten', 'tcp'],
+                            stdout=devnull, stderr=devnull)
+    deadline = time.time() + timeout
+    while not os.path.exists('/tmp/.X11-unix/X{0}'.format(n)):
+        if proc.poll() is not None or time.time() > deadline:
+            stop_xvfb(proc)
+            raise RuntimeError("Xvfb didn't start on " + name)
+        time.sleep(0.05)
+    return proc, name
+
+def stop_xvfb(proc):
+    if proc.poll() is None:
+        proc.terminate()
+        proc.wait()
+
+def make_config(directory, key, increment=1):
+    """Write a config for a benchmark run and return its path"""
+    path = os.path.join(directory, "config")
+    cfg = config.Config(path)
+    cfg.mixer.driver = 'Sim'
+    cfg.mixer.device = 'sim'
+    cfg.mixer.control = 'Sim'
+    cfg.mixer.increment = increment
+    cfg.hotkeys.enabled = True
+    cfg.hotkeys.backend = 'xlib'
+    cfg.hotkeys.up = key
+    cfg.status.socket = False
+    cfg.status.page = False
+    cfg.save()
+    return path
+
+def make_main(options, new_mixer, argv=()):
+    """Return a Main that opens new_mixer() instead of a real device"""
+    from pyvolwheel.main import Main, parse_args
+    from pyvolwheel.profiling import Profiler
+
+    class SimMain(Main):
+        def _discover(self):
+            # Nothing to discover
+            pass
+
+        def _new_mixer(self):
+            return new_mixer()
+    main_options = parse_args(list(argv) + ['--config', options.config])
+    main_options.headless = not options.gui
+    return SimMain(main_options, Profiler())
+
+def wait_for_hotkeys(main, timeout=30):
+    """Wait until main's hotkey listener has its grabs; False on timeout"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        # main.hkl is only set once the listener has been started
+        hkl = getattr(main, 'hkl', None)
+        if hkl is not None:
+            return hkl.ready.wait(max(0, deadline - time.time())) is True
+        time.sleep(0.01)
+    return False
+
+class Injector(threading.Thread):
+    """Presses a key through XTest at a fixed rate, logging when"""
+    def __init__(self, display_name, key, rate, count, mode):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        from Xlib import X
+        from Xlib.display import Display
+        from Xlib.ext import xtest
+        from pyvolwheel import hotkeys
+        self._X = X
+        self._xtest = xtest
+        self.display = Display(display_name)
+        keysym = hotkeys.string_to_keysym(key)
+        self.keycode = self.display.keysym_to_keycode(keysym)
+        if self.keycode == 0:
+            raise RuntimeError("No keycode for '{0}' on the test server"
+                               .format(key))
+        self.rate = rate
+        self.count = count
+        self.mode = mode
+        self.presses = []
+
+    def _fake(self, event_type):
+        self._xtest.fake_input(self.display, event_type, self.keycode)
+        self.display.sync()
+
+    def run(self):
+        X = self._X
+        interval = 1.0 / self.rate
+        start = time.time()
+        for i in range(self.count):
+            delay = start + i * interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            # In hold mode the key is never released, like auto-repeat
+            self.presses.append(time.time())
+            self._fake(X.KeyPress)
+            if self.mode == 'tap':
+                self._fake(X.KeyRelease)
+        if self.mode == 'hold':
+            self._fake(X.KeyRelease)
+
+def _percentile(values, pct):
+    if len(values) == 0: return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+def analyse(presses, writes, increment, late):
+    """Match presses to device writes; returns a dict of results
+
+    Writes can cover several presses (the worker merges them), so press n is
+    delivered by the first write that brings the total change to n steps.
+    """
+    latencies = []
+    total = 0
+    w = 0
+    for n, pressed in enumerate(presses, 1):
+        while w < len(writes) and total < n * increment:
+            total += writes[w][1]
+            w += 1
+            written = writes[w - 1][0]
+        if total < n * increment:
+            break
+        latencies.append(max(0.0, written - pressed))
+    return {'presses': len(presses),
+            'delivered': len(latencies),
+            'dropped': len(presses) - len(latencies),
+            'late': len([l for l in latencies if l > late]),
+            'writes': len(writes),
+            'p50': _percentile(latencies, 50),
+            'p90': _percentile(latencies, 90),
+            'p99': _percentile(latencies, 99),
+            'max': max(latencies) if latencies else float('nan')}
+
+def report(results):
+    ms = lambda s: "{0:.2f} ms".format(1000 * s)
+    return "\n".join([
+        "presses:   {0}".format(results['presses']),
+        "delivered: {0}".format(results['delivered']),
+        "dropped:   {0}".format(results['dropped']),
+        "late:      {0}".format(results['late']),
+        "writes:    {0}".format(results['writes']),
+        "latency:   p50 {0}  p90 {1}  p99 {2}  max {3}".format(
+            ms(results['p50']), ms(results['p90']), ms(results['p99']),
+            ms(results['max']))])
+
+def run(options):
+    xvfb, display_name = start_xvfb()
+    tmp = tempfile.mkdtemp(prefix='pyvolwheel-bench-')
+    old_display = os.environ.get('DISPLAY')
+    try:
+        os.environ['DISPLAY'] = display_name
+        os.environ.setdefault('XDG_RUNTIME_DIR', tmp)
+        options.config = make_config(tmp, options.key)
+        sim = SimMixer(latency=options.device_latency / 1000.0)
+        main = make_main(options, lambda: sim)
+        injector = Injector(display_name, options.key, options.rate,
+                            options.count, options.mode)
+        def start_injecting():
+            # Presses before the grabs are in would count as dropped
+            if wait_for_hotkeys(main) is False:
+                print >> sys.stderr, "The hotkey listener never got ready"
+                gobject.idle_add(main.ui.quit_main_loop)
+                return
+            injector.start()
+            injector.join()
+            # Let the last presses drain before stopping
+            time.sleep(options.settle)
+            gobject.idle_add(main.ui.quit_main_loop)
+        threading.Thread(target=start_injecting).start()
+        main.run()
+        return analyse(injector.presses, sim.writes, 1,
+                       options.late / 1000.0)
+    finally:
+        if old_display is None:
+            os.environ.pop('DISPLAY', None)
+        else:
+            os.environ['DISPLAY'] = old_display
+        stop_xvfb(xvfb)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def main(argv):
+    parser = OptionParser(usage="python -m pyvolwheel.bench [options]")
+    parser.add_option("--rate", type="float", default=30,
+                      help="key presses per second [default: %default]")
+    parser.add_option("--count", type="int", default=300,
+                      help="number of key presses [default: %default]")
+    parser.add_option("--mode", choices=('tap', 'hold'), default='tap',
+                      help="'tap' presses and releases the key, 'hold' "
+                           "sends presses without releases, like "
+                           "auto-repeat [default: %default]")
+    parser.add_option("--key", default="XF86AudioRaiseVolume",
+                      help="key to bind and press [default: %default]")
+    parser.add_option("--device-latency", type="float", default=0,
+                      metavar="MS",
+                      help="simulated time per device call [default: "
+                           "%default]")
+    parser.add_option("--late", type="float", default=50, metavar="MS",
+                      help="presses slower than this count as late "
+                           "[default: %default]")
+    parser.add_option("--settle", type="float", default=1.0,
+                      metavar="SECONDS",
+                      help="time to wait for the last presses to arrive "
+                           "[default: %default]")
+    parser.add_option("--gui", action="store_true", default=False,
+                      help="run the GTK interface instead of --headless")
+    options = parser.parse_args(argv)[0]
+    print report(run(options))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
@@ -23,6 +23,9 @@
 #
 
 import os
+import stat
+import errno
+import tempfile
 import ConfigParser
 
 class AttrDict(dict):
@@ -46,16 +49,23 @@ _DefaultSettings = {'mixer':
                       'control':         None,
                       'increment':       3,
                       'external':        "xterm -e 'alsamixer'",
-                      'update_interval': 1000}),
+                      'update_interval': 1000,
+                      'timeout':         1000}),
                     'restore':
             AttrDict({'enabled':   False,
                       'level':     0,
                       'muted':     False}),
                     'hotkeys':
             AttrDict({'enabled':   False,
+                      'backend':   "xlib",
                       'up':     "XF86AudioRaiseVolume",
                       'down':     "XF86AudioLowerVolume",
-                      'mute':      "XF86AudioMute"})}
+                      'mute':      "XF86AudioMute",
+                      # name=key pairs, e.g. "night=<Super>F12,music=<Super>F9"
+                      'profiles':  ""}),
+                    'status':
+            AttrDict({'socket':    True,
+                      'page':      True})}
 
 # If the env. variable XDG_CONFIG_HOME is set, use it for the config directory,
 # otherwise, default to ~/.config
@@ -64,6 +74,34 @@ _xdg_config_home = os.getenv('XDG_CONFIG_HOME',
 # Default: $XDG_CONFIG_HOME/pyvolwheel
 _default_config_path = os.path.join(_xdg_config_home, "pyvolwheel")
 
+def get_runtime_dir(create=True):
+    """Return $XDG_RUNTIME_DIR/pyvolwheel, creating it if needed
+
+    Raises OSError if the directory isn't a private one of ours: a real
+    directory (not a symlink), owned by us, with mode 0700.
+    """
+    base = os.getenv('XDG_RUNTIME_DIR')
+    if base is not None:
+        path = os.path.join(base, "pyvolwheel")
+    else:
+        # /tmp is shared, so keep users apart
+        path = os.path.join(tempfile.gettempdir(),
+                            "pyvolwheel-{0}".format(os.getuid()))
+    if create is True:
+        try:
+            os.mkdir(path, 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST: raise
+    elif not os.path.lexists(path):
+        return path
+    # Anyone could have made it first in /tmp; don't trust what we find
+    st = os.lstat(path)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+        stat.S_IMODE(st.st_mode) != 0700):
+        raise OSError(errno.EPERM, "Unsafe runtime directory "
+                      "(not a private directory of ours)", path)
+    return path
+
 class Config(AttrDict):
     def __init__(self, path=None):
         if path is None: path = _default_config_path
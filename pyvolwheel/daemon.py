@@ -0,0 +1,199 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+# Hotkeys for many X displays from one process.
+#
+# Each session is an X display with its own binds and mixer, usually read
+# from that user's config file:
+#
+#   python -m pyvolwheel.daemon :1=/home/a/.config/pyvolwheel :2 ...
+#
+# A session without a config file uses the default one. All the displays are
+# watched from one main loop, without a thread or timer per session; sessions
+# using the same mixer control share one mixer thread. The daemon exits once
+# every display has gone away.
+
+import sys
+import threading
+from optparse import OptionParser
+import gobject
+from pyvolwheel import config, mixer, hotkeys, worker, headless
+from pyvolwheel.main import discover
+
+if hotkeys.available is True:
+    from Xlib import error as Xerror
+
+class Session(object):
+    """One display: its keys and the mixer its hotkeys act on"""
+    __slots__ = ('name', 'keys', 'target', 'increment', 'watch')
+
+    def __init__(self, name, keys, target, increment):
+        self.name = name
+        self.keys = keys
+        self.target = target
+        self.increment = increment
+        self.watch = None
+
+class Daemon(object):
+    def __init__(self):
+        self.sessions = {}
+        # (driver, device, control) -> [mixer, worker, session count]
+        self._targets = {}
+
+    def add_session(self, name, cfg):
+        """Start serving the display name with the settings in cfg"""
+        discover(cfg.mixer)
+        binds = {  'up': cfg.hotkeys.up,
+                 'down': cfg.hotkeys.down,
+                 'mute': cfg.hotkeys.mute}
+        target = (cfg.mixer.driver, cfg.mixer.device, cfg.mixer.control)
+        keys = hotkeys.DisplayKeys(binds, name)
+        try:
+            self._acquire(target, cfg.mixer.timeout / 1000.0)
+        except mixer.MixerError:
+            keys.display.close()
+            raise
+        session = Session(name, keys, target, cfg.mixer.increment)
+        keys.grab()
+        session.watch = gobject.io_add_watch(keys.fileno(),
+                                             gobject.IO_IN | gobject.IO_HUP |
+                                             gobject.IO_ERR,
+                                             self._on_input, session)
+        self.sessions[name] = session
+
+    def remove_session(self, name):
+        session = self.sessions.pop(name)
+        if session.watch is not None:
+            gobject.source_remove(session.watch)
+        try:
+            session.keys.close()
+        except Xerror.ConnectionClosedError:
+            # The display is already gone, and its grabs with it
+            pass
+        self._release(session.target)
+
+    def _acquire(self, target, timeout):
+        if target in self._targets:
+            self._targets[target][2] += 1
+            return
+        m = mixer.open_mixer(*target)
+        w = worker.MixerWorker(m, self._on_state, timeout)
+        w.start()
+        self._targets[target] = [m, w, 1]
+
+    def _release(self, target):
+        entry = self._targets[target]
+        entry[2] -= 1
+        if entry[2] > 0: return
+        del self._targets[target]
+        m, w = entry[0], entry[1]
+        w.stop()
+        w.join(w.timeout)
+        if w.is_alive():
+            # Leave a hung device to its worker
+            m.abandon()
+        else:
+            m.close()
+
+    def _on_state(self, state, error):
+        # Nothing to display; only errors are worth mentioning
+        if error is not None:
+            print >> sys.stderr, "pyvolwheel: " + error
+        return False
+
+    def _on_input(self, fd, condition, session):
+        try:
+            acts = session.keys.read()
+        except Xerror.ConnectionClosedError:
+            acts = None
+        if acts is None or condition & (gobject.IO_HUP | gobject.IO_ERR):
+            # The session ended
+            gobject.idle_add(self._drop, session.name)
+            return False
+        w = self._targets[session.target][1]
+        for act in acts:
+            if act == 'up':
+                w.change_volume(session.increment)
+            elif act == 'down':
+                w.change_volume(-session.increment)
+            elif act == 'mute':
+                w.toggle_mute()
+        return True
+
+    def _drop(self, name):
+        if name in self.sessions:
+            # The watch removed itself by returning False
+            self.sessions[name].watch = None
+            self.remove_session(name)
+        if len(self.sessions) == 0:
+            headless.quit_main_loop()
+        return False
+
+    def close(self):
+        for name in self.sessions.keys():
+            self.remove_session(name)
+        mixer.release_handles()
+
+def parse_session(arg):
+    """Split "DISPLAY[=CONFIG]" into (display, config path or None)"""
+    if '=' in arg:
+        name, path = arg.split('=', 1)
+        return name, path
+    return arg, None
+
+def main(argv):
+    parser = OptionParser(usage="python -m pyvolwheel.daemon "
+                                "DISPLAY[=CONFIG] ...")
+    args = parser.parse_args(argv)[1]
+    if len(args) == 0:
+        parser.error("no displays given")
+    if hotkeys.available is False:
+        print >> sys.stderr, "python-xlib is needed for the daemon"
+        return 1
+    headless.threads_init()
+    daemon = Daemon()
+    for arg in args:
+        name, path = parse_session(arg)
+        try:
+            daemon.add_session(name, config.Config(path))
+        except (Xerror.DisplayError, mixer.MixerError) as e:
+            print >> sys.stderr, "{0}: {1}".format(name, str(e))
+    if len(daemon.sessions) == 0:
+        return 1
+    print >> sys.stderr, ("Serving {0} displays with {1} threads, "
+                          "RSS {2} kB").format(len(daemon.sessions),
+                                               threading.active_count(),
+                                               headless.get_rss_kb())
+    try:
+        headless.run_main_loop()
+    except KeyboardInterrupt:
+        pass
+    daemon.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
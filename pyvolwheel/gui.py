@@ -30,6 +30,9 @@ import gobject
 import pyvolwheel
 from pyvolwheel import mixer
 from pyvolwheel import hotkeys
+from pyvolwheel import snapshot
+
+hotkeys.set_thread_lock(gtk.gdk.threads_enter, gtk.gdk.threads_leave)
 
 _volume_icons = ('audio-volume-muted',
                  'audio-volume-low',
@@ -59,6 +62,15 @@ def _idx(widget, text):
     except:
         return -1
 
+def threads_init():
+    gtk.gdk.threads_init()
+
+def run_main_loop():
+    gtk.main()
+
+def quit_main_loop():
+    gtk.main_quit()
+
 class ConfigDialog(gtk.Window):
     def _set_saveable(self, widget):
         # Enable/Disable the save button
@@ -85,7 +97,13 @@ class ConfigDialog(gtk.Window):
         self.control_combo.set_active(_idx(self.control_combo, control))
         self._filling = False
         # See note in on_driver_changed()
-        if self.driver_combo.get_active_text() == 'ALSA':
+        self._set_inc_range()
+
+    def _set_inc_range(self):
+        # Older pyalsaaudio only works in rounded percentages, where an
+        # increment of less than 3 can get stuck
+        if (self.driver_combo.get_active_text() == 'ALSA' and
+            not mixer.alsa_exact_steps):
             self.inc_spinner.set_range(3, 99)
         else:
             self.inc_spinner.set_range(1, 99)
@@ -133,12 +151,7 @@ class ConfigDialog(gtk.Window):
     def on_driver_changed(self, _):
         if self._filling is True: return False
         self._fill_devices()
-        # For some reason when using an ALSA mixer, the inc. can't be less
-        # than 3. Bug?
-        if self.driver_combo.get_active_text() == 'ALSA':
-            self.inc_spinner.set_range(3, 99)
-        else:
-            self.inc_spinner.set_range(1, 99)
+        self._set_inc_range()
         return True
 
     def on_device_changed(self, _):
@@ -159,9 +172,37 @@ class ConfigDialog(gtk.Window):
         self._main.config.hotkeys.mute = self.hk_mute_tbox.get_text()
         self._main.config.save()
         self._main.reload()
-        self.destroy()
+        self.hide()
         return True
 
+    def on_delete(self, wdg, event):
+        # Keep the window around for next time
+        self.hide()
+        return True
+
+    def _load_settings(self):
+        config = self._main.config
+        # Only re-enumerate the hardware if the combos don't already show
+        # the current settings (e.g. after a cancelled change)
+        if (self.driver_combo.get_active_text() != config.mixer.driver or
+            self.device_combo.get_active_text() != str(config.mixer.device) or
+            self.control_combo.get_active_text() != config.mixer.control):
+            self._fill_combos()
+        self.inc_spinner.set_value(config.mixer.increment)
+        self.rest_check.set_active(config.restore.enabled)
+        self.xm_tbox.set_text(config.mixer.external)
+        self.hk_cb.set_active(config.hotkeys.enabled)
+        self.hk_frame.set_sensitive(config.hotkeys.enabled)
+        self.hk_up_tbox.set_text(config.hotkeys.up)
+        self.hk_down_tbox.set_text(config.hotkeys.down)
+        self.hk_mute_tbox.set_text(config.hotkeys.mute)
+
+    def popup(self):
+        # Refresh the settings and show the (possibly hidden) dialog
+        self._load_settings()
+        self.show_all()
+        self.present()
+
     def on_hk_toggled(self, wdg):
         self.hk_frame.set_sensitive(wdg.get_active())
 
@@ -172,6 +213,7 @@ class ConfigDialog(gtk.Window):
         self.set_title(title)
         self.set_border_width(10)
         self.set_position(gtk.WIN_POS_CENTER)
+        self.connect('delete-event', self.on_delete)
         # Flag to ignore combobox changes if they're being populated
         self._filling = False
         # Main VBox
@@ -215,7 +257,6 @@ class ConfigDialog(gtk.Window):
         self.inc_spinner.set_range(1, 99)
         self.inc_spinner.set_increments(1, 10)
         self.inc_spinner.set_numeric(True)
-        self.inc_spinner.set_value(main.config.mixer.increment)
         inc_hbox.pack_start(inc_label, expand=False, padding=5)
         inc_hbox.pack_end(self.inc_spinner, expand=False, padding=5)
         mixer_vbox.pack_start(inc_hbox, expand=False, padding=0)
@@ -223,7 +264,6 @@ class ConfigDialog(gtk.Window):
         rest_hbox = gtk.HBox(spacing=10)
         rest_label = gtk.Label("Restore volume at startup")
         self.rest_check = gtk.CheckButton()
-        self.rest_check.set_active(main.config.restore.enabled)
         rest_hbox.pack_start(rest_label, expand=False, padding=5)
         rest_hbox.pack_end(self.rest_check, expand=False, padding=5)
         mixer_vbox.pack_start(rest_hbox, expand=False, padding=0)
@@ -231,7 +271,6 @@ class ConfigDialog(gtk.Window):
         xm_hbox = gtk.HBox(spacing=10)
         xm_label = gtk.Label("External Mixer")
         self.xm_tbox = gtk.Entry()
-        self.xm_tbox.set_text(main.config.mixer.external)
         # Set tooltips
         xm_tip = "Program to launch when the mixer button is pressed"
         xm_hbox.set_tooltip_text(xm_tip)
@@ -245,27 +284,25 @@ class ConfigDialog(gtk.Window):
         #### End Mixer Settings Tab
         #### Hotkeys Tab
         hk_vbox = gtk.VBox()
-        hk_vbox.set_sensitive(hotkeys.available)
-        if hotkeys.available is False:
+        hk_avail = hotkeys.available or hotkeys.evdev_available
+        hk_vbox.set_sensitive(hk_avail)
+        if hk_avail is False:
             hk_vbox.set_tooltip_text("Install python-xlib to use hotkeys")
         # Enabled Checkbox
         hk_cb_hbox = gtk.HBox(spacing=10)
         hk_cb_label = gtk.Label("Global Hotkeys")
         self.hk_cb = gtk.CheckButton("Enabled")
-        self.hk_cb.set_active(main.config.hotkeys.enabled)
         self.hk_cb.connect('toggled', self.on_hk_toggled)
         hk_cb_hbox.pack_start(hk_cb_label, expand=False, padding=5)
         hk_cb_hbox.pack_end(self.hk_cb, expand=False, padding=5)
         hk_vbox.pack_start(hk_cb_hbox, expand=False, padding=0)
         # Keybinds Frame
         self.hk_frame = gtk.Frame()
-        self.hk_frame.set_sensitive(main.config.hotkeys.enabled)
         hk_frame_vbox = gtk.VBox(spacing=10)
         # Raise Volume Key
         hk_up_hbox = gtk.HBox(spacing=10)
         hk_up_label = gtk.Label("Raise Volume Key")
         self.hk_up_tbox = gtk.Entry()
-        self.hk_up_tbox.set_text(main.config.hotkeys.up)
         hk_up_hbox.pack_start(hk_up_label, expand=False, padding=5)
         hk_up_hbox.pack_end(self.hk_up_tbox, expand=False, padding=5)
         hk_frame_vbox.pack_start(hk_up_hbox, expand=False, padding=0)
@@ -273,7 +310,6 @@ class ConfigDialog(gtk.Window):
         hk_down_hbox = gtk.HBox(spacing=10)
         hk_down_label = gtk.Label("Lower Volume Key")
         self.hk_down_tbox = gtk.Entry()
-        self.hk_down_tbox.set_text(main.config.hotkeys.down)
         hk_down_hbox.pack_start(hk_down_label, expand=False, padding=5)
         hk_down_hbox.pack_end(self.hk_down_tbox, expand=False, padding=5)
         hk_frame_vbox.pack_start(hk_down_hbox, expand=False, padding=0)
@@ -281,7 +317,6 @@ class ConfigDialog(gtk.Window):
         hk_mute_hbox = gtk.HBox(spacing=10)
         hk_mute_label = gtk.Label("Mute Volume Key")
         self.hk_mute_tbox = gtk.Entry()
-        self.hk_mute_tbox.set_text(main.config.hotkeys.mute)
         hk_mute_hbox.pack_start(hk_mute_label, expand=False, padding=5)
         hk_mute_hbox.pack_end(self.hk_mute_tbox, expand=False, padding=5)
         hk_frame_vbox.pack_start(hk_mute_hbox, expand=False, padding=0)
@@ -295,7 +330,7 @@ class ConfigDialog(gtk.Window):
         bottom_hbox = gtk.HBox(spacing=5)
         # Cancel Button
         cancel_button = gtk.Button(stock='gtk-cancel')
-        cancel_button.connect_object('clicked', gtk.Widget.destroy, self)
+        cancel_button.connect_object('clicked', gtk.Widget.hide, self)
         bottom_hbox.pack_start(cancel_button)
         # Save Button
         self.save_button = gtk.Button(stock='gtk-save')
@@ -304,33 +339,50 @@ class ConfigDialog(gtk.Window):
         main_vbox.pack_start(bottom_hbox)
         # Add everything to the window
         self.add(main_vbox)
-        # Populate the combo boxes
-        self._fill_combos()
-        self.show_all()
-        self.present()
+        # Populate the combo boxes and the rest of the settings
+        self._load_settings()
 
 class MiniMixer(gtk.Window):
     def launch_mixer(self, button):
         Popen(self._main.config.mixer.external, shell=True)
 
-    def update(self):
-        control = self._main.mixer.get_control()
+    def update(self, control, level):
         self.label.set_text(control)
-        vol = self._main.mixer.get_volume()[0]
-        self.slider.set_value(vol)
+        # Don't echo the new value back to the mixer
+        self.slider.handler_block(self._change_handler)
+        self.slider.set_value(level)
+        self.slider.handler_unblock(self._change_handler)
 
     def on_change(self, wdg):
-        self._main.mixer.set_volume(int(wdg.get_value()))
-        # Force the tray icon to update
-        self._main.icon.update()
+        self._main.set_volume(int(wdg.get_value()))
         return True
 
+    def popup(self):
+        # Refresh from the last known state and show the window at the mouse
+        inc = self._main.config.mixer.increment
+        self.slider.set_increments(inc, inc*2)
+        if self._main.state is not None:
+            control, level, _ = self._main.state
+            self.update(control, level)
+        x, y = self.get_screen().get_root_window().get_pointer()[:2]
+        width, height = self.size_request()
+        self.move(max(0, x - width // 2), max(0, y - height // 2))
+        self.show_all()
+        self.present()
+        self.slider.grab_focus()
+        self.shown = True
+
+    def popdown(self):
+        self.hide()
+        self.shown = False
+
     def __init__(self, main):
         super(MiniMixer, self).__init__(gtk.WINDOW_TOPLEVEL)
         self._main = main
+        # Built once and then shown/hidden as needed
+        self.shown = False
         self.set_decorated(False)
         self.set_skip_taskbar_hint(True)
-        self.set_position(gtk.WIN_POS_MOUSE)
         self.set_keep_above(True)
         self.set_border_width(5)
         # Main VBox
@@ -344,8 +396,6 @@ class MiniMixer(gtk.Window):
         # Volume Slider
         self.slider = gtk.VScale()
         self.slider.set_range(0, 100)
-        inc = self._main.config.mixer.increment
-        self.slider.set_increments(inc, inc*2)
         self.slider.set_digits(0)
         self.slider.set_value_pos(gtk.POS_BOTTOM)
         self.slider.set_inverted(True)
@@ -356,14 +406,9 @@ class MiniMixer(gtk.Window):
         vbox.pack_start(self.label)
         # Add main VBox to window
         self.add(vbox)
-        # Update label and slider value
-        self.update()
-        # Connect after update() so we don't catch the signal(s) caused as a
-        # result of update()'s call to set_value()
-        self.slider.connect('value-changed', self.on_change)
-        self.slider.grab_focus()
-        self.show_all()
-        self.present()
+        self._change_handler = self.slider.connect('value-changed',
+                                                   self.on_change)
+        vbox.show_all()
 
 class TrayMenu(gtk.Menu):
     def on_about_click(self, item):
@@ -389,20 +434,66 @@ class TrayMenu(gtk.Menu):
         return True
 
     def on_prefs_click(self, item):
-        ConfigDialog(self._main)
+        with self._main.profiler.phase('preferences'):
+            # There's only ever one settings window
+            if self.prefs is None:
+                self.prefs = ConfigDialog(self._main)
+            self.prefs.popup()
+        return True
+
+    def on_profile_click(self, item, name):
+        self._main.apply_profile(name)
         return True
 
+    def on_save_profile_click(self, item):
+        dlg = gtk.Dialog("Save Profile", None, gtk.DIALOG_MODAL,
+                         (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+                          gtk.STOCK_SAVE, gtk.RESPONSE_OK))
+        dlg.set_default_response(gtk.RESPONSE_OK)
+        entry = gtk.Entry()
+        entry.set_activates_default(True)
+        entry.set_tooltip_text("Name for the current state of all controls")
+        dlg.vbox.pack_start(entry, padding=5)
+        entry.show()
+        if dlg.run() == gtk.RESPONSE_OK:
+            name = entry.get_text().strip()
+            if len(name) > 0:
+                self._main.save_profile(name)
+        dlg.destroy()
+        return True
+
+    def _fill_profiles(self, _=None):
+        # Rebuilt every time the menu is shown, so new profiles show up
+        menu = gtk.Menu()
+        for name in snapshot.list_profiles():
+            item = gtk.MenuItem(name, use_underline=False)
+            item.connect('activate', self.on_profile_click, name)
+            menu.append(item)
+        if len(menu.get_children()) > 0:
+            menu.append(gtk.SeparatorMenuItem())
+        item_save = gtk.MenuItem("Save Current...")
+        item_save.connect('activate', self.on_save_profile_click)
+        menu.append(item_save)
+        menu.show_all()
+        self.item_profiles.set_submenu(menu)
+
     def on_quit_click(self, _):
-        gtk.main_quit()
+        quit_main_loop()
         return True
 
     def __init__(self, main):
         super(TrayMenu, self).__init__()
         self._main = main
+        # Built the first time it's needed
+        self.prefs = None
+        self.item_profiles = gtk.MenuItem("Profiles")
+        item_sep0  = gtk.SeparatorMenuItem()
         item_prefs = gtk.ImageMenuItem('gtk-preferences')
         item_about = gtk.ImageMenuItem('gtk-about')
         item_sep1  = gtk.SeparatorMenuItem()
         item_quit  = gtk.ImageMenuItem('gtk-quit')
+        self.append(self.item_profiles)
+        self.append(item_sep0)
         self.append(item_prefs)
         self.append(item_about)
         self.append(item_sep1)
@@ -410,26 +501,28 @@ class TrayMenu(gtk.Menu):
         item_prefs.connect('activate', self.on_prefs_click)
         item_about.connect('activate', self.on_about_click)
         item_quit.connect('activate', self.on_quit_click)
+        self._fill_profiles()
+        self.connect('show', self._fill_profiles)
         self.show_all()
 
 class TrayIcon(gtk.StatusIcon):
     def update(self):
-        try:
-            control = self._main.mixer.get_control()
-            volume = self._main.mixer.get_volume()[0]
-            is_muted = self._main.mixer.get_mute()
-        except mixer.MixerError as e:
-            self.set_error(str(e))
-        else:
-            self.set_level(control, volume, is_muted)
+        # The new state arrives through Main.on_mixer_state()
+        worker = self._main.worker
+        if worker is None:
+            return True
+        with self._main.profiler.phase('icon update'):
+            if worker.hung is True:
+                self.set_error("Device is not responding")
+            worker.refresh()
         return True
 
     def reload(self):
         # Reset timer for new value in config
-        if self._timeout is not None:
-            gobject.source_remove(self._timeout)
+        self._main.scheduler.remove(self._timeout)
         interval = self._main.config.mixer.update_interval
-        self._timeout = gobject.timeout_add(interval, self.update)
+        self._timeout = self._main.scheduler.add(interval / 1000.0,
+                                                 self.update)
         self.update()
 
     def set_error(self, tooltip):
@@ -450,8 +543,8 @@ class TrayIcon(gtk.StatusIcon):
             self.set_from_icon_name(icon)
             self._last_icon = icon
         # Update the minimixer, if it's open
-        if self.minimixer is not None:
-            self.minimixer.update()
+        if self.minimixer is not None and self.minimixer.shown is True:
+            self.minimixer.update(control, level)
 
     def on_scroll(self, wdgt, event):
         if event.direction == gtk.gdk.SCROLL_UP:
@@ -468,20 +561,20 @@ class TrayIcon(gtk.StatusIcon):
             return True
 
     def on_mm_focus_out(self, wdgt, event):
-        self.minimixer.destroy()
-        self.minimixer = None
-        pass
+        self.minimixer.popdown()
 
-    def on_activate(self, wdgt):
+    def _build_minimixer(self):
         if self.minimixer is None:
-            # Create it
             self.minimixer = MiniMixer(self._main)
             self.minimixer.connect('focus-out-event', self.on_mm_focus_out)
+        return False
+
+    def on_activate(self, wdgt):
+        self._build_minimixer()
+        if self.minimixer.shown is False:
+            self.minimixer.popup()
         else:
-            # Destroy it >:)
-            self.minimixer.destroy()
-            del self.minimixer
-            self.minimixer = None
+            self.minimixer.popdown()
         return False
 
     def __init__(self, main):
@@ -498,5 +591,8 @@ class TrayIcon(gtk.StatusIcon):
             self.menu.popup(None, None, gtk.status_icon_position_menu,
                             button, a_time, sicon)
         self.connect('popup-menu', popup_menu)
+        # Build the minimixer once startup is done, so the first click on
+        # the icon doesn't have to
+        gobject.idle_add(self._build_minimixer)
 
 # vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
@@ -0,0 +1,101 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+# Stand-ins for the parts of pyvolwheel.gui that a headless instance needs:
+# a plain GLib main loop and somewhere for status updates to go. Nothing in
+# here (or anything it imports) may pull in GTK.
+
+import sys
+import signal
+import gobject
+
+# Targets for 'pyvolwheel --headless', enforced by --check-budget
+RSS_TARGET_KB = 16 * 1024
+STARTUP_TARGET = 0.25   # seconds
+
+_loop = None
+
+def threads_init():
+    gobject.threads_init()
+
+def run_main_loop():
+    global _loop
+    _loop = gobject.MainLoop()
+    # Let SIGTERM shut down cleanly so the volume still gets saved
+    signal.signal(signal.SIGTERM, lambda signum, frame: quit_main_loop())
+    _loop.run()
+
+def quit_main_loop():
+    if _loop is not None:
+        _loop.quit()
+
+def get_rss_kb():
+    """Resident set size of this process in kB (0 if unknown)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (IOError, ValueError):
+        pass
+    return 0
+
+def check_budget(startup_time):
+    """Return a list of the ways this process misses the headless targets"""
+    problems = []
+    for mod in ('gtk', 'pyvolwheel.gui'):
+        if mod in sys.modules:
+            problems.append("{0} was imported".format(mod))
+    rss = get_rss_kb()
+    if rss > RSS_TARGET_KB:
+        problems.append("RSS is {0} kB (target {1} kB)".format(rss,
+                        RSS_TARGET_KB))
+    if startup_time > STARTUP_TARGET:
+        problems.append("startup took {0:.0f} ms (target {1:.0f} ms)".format(
+                        1000 * startup_time, 1000 * STARTUP_TARGET))
+    return problems
+
+class TrayIcon(object):
+    """Takes the tray icon's place; errors are reported on stderr"""
+    def __init__(self, main):
+        self._main = main
+        self._last_error = None
+
+    def update(self):
+        return True
+
+    def reload(self):
+        # Nothing to show, so nothing to poll for
+        pass
+
+    def set_error(self, tooltip):
+        if tooltip != self._last_error:
+            print >> sys.stderr, "pyvolwheel: " + tooltip
+            self._last_error = tooltip
+
+    def set_level(self, control, level, muted=False):
+        self._last_error = None
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
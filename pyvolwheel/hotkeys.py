@@ -23,100 +23,471 @@
 #
 
 try:
-    from Xlib import X
+    from Xlib import X, XK
     from Xlib.display import Display
+    # The XF86 media keys aren't loaded by default
+    XK.load_keysym_group('xf86')
 except ImportError:
     available = False
 else:
     available = True
 
+import os
+import re
+import sys
+import glob
+import errno
+import struct
 import select
 import threading
-import gtk.gdk
 import gobject
 
-def parse_key(key):
-    # Returns a (keycode, modifiers) tuple
-    keymap = gtk.gdk.keymap_get_default()
-    # Parse
-    keyval, mods = gtk.accelerator_parse(key)
-    if gtk.accelerator_valid(keyval, mods):
-        keycode = keymap.get_entries_for_keyval(keyval)[0][0]
-        return keycode, int(mods)
-
-def get_known_modifiers():
-    gdk_modifiers = (gtk.gdk.CONTROL_MASK, gtk.gdk.SHIFT_MASK,
-                     gtk.gdk.MOD1_MASK, gtk.gdk.MOD2_MASK,
-                     gtk.gdk.MOD3_MASK, gtk.gdk.MOD4_MASK,
-                     gtk.gdk.MOD5_MASK, gtk.gdk.SUPER_MASK,
-                     gtk.gdk.HYPER_MASK)
-    mask = 0
-    for modifier in gdk_modifiers:
-        if "Mod" not in gtk.accelerator_name (0, modifier):
-            mask |= modifier
-    return mask
-
-class HotKeyListener(gobject.GObject, threading.Thread):
+# The evdev backend only needs the kernel's input devices, not an X server
+evdev_available = os.path.isdir('/dev/input')
+
+# struct input_event: struct timeval, __u16 type, __u16 code, __s32 value
+_EV_FORMAT = 'llHHi'
+_EV_SIZE = struct.calcsize(_EV_FORMAT)
+_EV_KEY = 0x01
+# Values of an EV_KEY event
+_KEY_RELEASE, _KEY_PRESS, _KEY_REPEAT = 0, 1, 2
+
+# Keysym names (as used in the config) mapped to linux/input.h keycodes
+_evdev_keys = {'XF86AudioMute':        113,
+               'XF86AudioMicMute':     248,
+               'XF86AudioLowerVolume': 114,
+               'XF86AudioRaiseVolume': 115,
+               'XF86AudioPlay':        164,
+               'XF86AudioStop':        166,
+               'XF86AudioPrev':        165,
+               'XF86AudioNext':        163,
+               'Up':                   103,
+               'Down':                 108,
+               'Left':                 105,
+               'Right':                106,
+               'Page_Up':              104,
+               'Page_Down':            109,
+               'Home':                 102,
+               'End':                  107,
+               'Insert':               110,
+               'Delete':               111,
+               'space':                57,
+               'minus':                12,
+               'equal':                13}
+_evdev_keys.update(('KP_{0}'.format(n), c) for n, c in
+                   enumerate((82, 79, 80, 81, 75, 76, 77, 71, 72, 73)))
+_evdev_keys.update({'KP_Add':      78,
+                    'KP_Subtract': 74,
+                    'KP_Multiply': 55,
+                    'KP_Divide':   98,
+                    'KP_Decimal':  83,
+                    'KP_Enter':    96})
+# 1-9 then 0
+_evdev_keys.update((str((n + 1) % 10), c) for n, c in
+                   enumerate(range(2, 12)))
+_evdev_keys.update(('F{0}'.format(n), c) for n, c in
+                   zip(range(1, 13), range(59, 69) + [87, 88]))
+_evdev_keys.update((chr(ord('a') + n), c) for n, c in
+                   enumerate((30, 48, 46, 32, 18, 33, 34, 35, 23, 36, 37, 38,
+                              50, 49, 24, 25, 16, 19, 31, 20, 22, 47, 17, 45,
+                              21, 44)))
+# Modifier keycodes, mapped to the modifier name used in accelerators
+_evdev_modifiers = {29: 'control', 97: 'control',
+                    42: 'shift',   54: 'shift',
+                    56: 'alt',     100: 'alt',
+                    125: 'super',  126: 'super'}
+# What Mod1 and Mod4 usually are, for evdev binds written that way
+_evdev_mod_names = {'mod1': 'alt', 'mod4': 'super'}
+# Modifier names accepted in accelerators (as GTK does), lower case
+# <Release> isn't a modifier: it makes the bind act when the key goes up
+_accel_modifiers = {'control': 'control', 'ctrl': 'control',
+                    'ctl': 'control', 'primary': 'control',
+                    'shift': 'shift', 'shft': 'shift',
+                    'alt': 'alt', 'super': 'super', 'hyper': 'hyper',
+                    'meta': 'meta', 'mod1': 'mod1', 'mod2': 'mod2',
+                    'mod3': 'mod3', 'mod4': 'mod4', 'mod5': 'mod5',
+                    'release': 'release'}
+
+# X modifier masks (X.ShiftMask etc.) that don't depend on the mapping
+_x_fixed_modifiers = {'shift': 1 << 0, 'control': 1 << 2,
+                      'mod1': 1 << 3, 'mod2': 1 << 4, 'mod3': 1 << 5,
+                      'mod4': 1 << 6, 'mod5': 1 << 7}
+# Modifiers that are whichever of Mod1-Mod5 their keys are mapped to
+_x_mapped_modifiers = {'alt': ('Alt_L', 'Alt_R'),
+                       'super': ('Super_L', 'Super_R'),
+                       'hyper': ('Hyper_L', 'Hyper_R'),
+                       'meta': ('Meta_L', 'Meta_R'),
+                       'numlock': ('Num_Lock',)}
+
+# Called around emitting 'key-press' on the main loop; the GUI sets these to
+# gtk.gdk.threads_enter/leave
+_threads_enter = _threads_leave = lambda: None
+
+def set_thread_lock(enter, leave):
+    global _threads_enter, _threads_leave
+    _threads_enter, _threads_leave = enter, leave
+
+def _warn_bind(what, reason):
+    print >> sys.stderr, "pyvolwheel: ignoring hotkey {0}: {1}".format(what,
+                                                                   reason)
+
+def _split_accel(key):
+    # Splits an accelerator like "<Control><Alt>Up" into (modifiers, name),
+    # where modifiers is a frozenset of modifier names, or returns None
+    mods = re.findall(r'<([^>]+)>', key)
+    name = re.sub(r'<[^>]+>', '', key).strip()
+    for m in mods:
+        if m.lower() not in _accel_modifiers:
+            _warn_bind("'{0}'".format(key), "unknown modifier <{0}>".format(m))
+            return None
+    if len(name) == 0:
+        _warn_bind("'{0}'".format(key), "no key given")
+        return None
+    return frozenset(_accel_modifiers[m.lower()] for m in mods), name
+
+def string_to_keysym(name):
+    """Return the keysym for name as GTK spells it, or X.NoSymbol
+
+    python-xlib names the XF86 keysyms XF86_AudioMute and so on, where GTK
+    (and the config) use XF86AudioMute.
+    """
+    keysym = XK.string_to_keysym(name)
+    if keysym == X.NoSymbol and name.startswith('XF86'):
+        keysym = XK.string_to_keysym('XF86_' + name[4:])
+    return keysym
+
+def parse_accel(key):
+    # Returns a (keysym, modifier names) tuple; both stay valid across
+    # keyboard and modifier mapping changes
+    accel = _split_accel(key)
+    if accel is None: return None
+    mods, name = accel
+    keysym = string_to_keysym(name)
+    if keysym == X.NoSymbol:
+        _warn_bind("'{0}'".format(key), "unknown key '{0}'".format(name))
+        return None
+    return keysym, mods
+
+def get_modifier_masks(display):
+    """Return modifier name -> X mask, following display's modifier mapping
+
+    Modifiers like Alt and Super are whichever of Mod1-Mod5 their keys are
+    mapped to, and missing if they aren't mapped at all.
+    """
+    masks = dict(_x_fixed_modifiers)
+    mapping = display.get_modifier_mapping()
+    for name, keysyms in _x_mapped_modifiers.iteritems():
+        codes = set(display.keysym_to_keycode(XK.string_to_keysym(k))
+                    for k in keysyms)
+        codes.discard(0)
+        # Mod1 to Mod5
+        for i in range(3, 8):
+            if codes & set(mapping[i]):
+                masks[name] = 1 << i
+                break
+    return masks
+
+def parse_evdev_key(key):
+    # Returns a (keycode, modifiers) tuple, where modifiers is a frozenset of
+    # modifier names
+    accel = _split_accel(key)
+    if accel is None: return None
+    mods, name = accel
+    # No modifier mapping here; use the usual one
+    mods = frozenset(_evdev_mod_names.get(m, m) for m in mods)
+    known = set(_evdev_modifiers.itervalues()) | set(['release'])
+    for m in mods:
+        if m not in known:
+            _warn_bind("'{0}'".format(key), "<{0}> isn't supported by the "
+                       "evdev backend".format(m.capitalize()))
+            return None
+    if name in _evdev_keys:
+        return _evdev_keys[name], mods
+    elif name.lower() in _evdev_keys:
+        return _evdev_keys[name.lower()], mods
+    _warn_bind("'{0}'".format(key), "unknown key '{0}' for the evdev "
+               "backend".format(name))
+
+def get_evdev_devices():
+    # Returns the paths of all the event devices we can find
+    return sorted(glob.glob('/dev/input/event*'))
+
+class _Listener(gobject.GObject, threading.Thread):
     __gsignals__ = {
             'key-press': (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE,
                           (gobject.TYPE_STRING,))
             }
 
-    def __init__(self, keybinds):
+    def __init__(self):
         gobject.GObject.__init__(self)
         threading.Thread.__init__(self)
-        self.display = Display()
+        self._running = True
+        # Set once the listener is actually receiving its keys
+        self.ready = threading.Event()
+        # stop() writes to this to wake run() up, so run() can block in
+        # select() without a timeout
+        self._wake_r, self._wake_w = os.pipe()
+
+    def _emit(self, key):
+        _threads_enter()
+        self.emit('key-press', key)
+        _threads_leave()
+
+    def _wait(self, fds):
+        # Block until one of fds (or the wake pipe) is readable
+        try:
+            return select.select(list(fds) + [self._wake_r], [], [])[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+
+    def _close_wake(self):
+        self._running = False
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def stop(self):
+        if self._running is False: return
+        self._running = False
+        os.write(self._wake_w, 'x')
+
+class DisplayKeys(object):
+    """The grabs and binds for one X display, without a thread of its own
+
+    HotKeyListener waits on one from its own thread; the multi-display
+    daemon waits on many from a single main loop.
+    """
+    def __init__(self, keybinds, display=None):
+        self.display = Display(display)
         self.screen = self.display.screen()
         self.root = self.screen.root
-        self._mod_mask = get_known_modifiers()
-        self._keys = {}
-        # Parse and load the keybinds:
+        # Parse the keybinds into keysyms and modifier names; they're
+        # resolved to keycodes and masks against the X server's mappings so
+        # they can follow mapping changes
+        self._binds = {}
         for act, key in keybinds.iteritems():
-            km = parse_key(key)
+            km = parse_accel(key)
             if km is not None:
-                self._keys[km] = act
+                self._binds[km] = act
+        self._read_modifiers()
+        self._keys = self._resolve_keys(warn=True)
+        # (keycode, modifiers) pairs currently grabbed
+        self._grabbed = set()
 
-    def _grab(self):
-        for keycode, _ in self._keys.keys():
-            self.root.grab_key(keycode, X.AnyModifier, True,
-                               X.GrabModeAsync,
-                               X.GrabModeSync)
+    def _resolve_keys(self, warn=False):
+        # Map (keycode, modifier mask, on release) -> action using the
+        # current mappings
+        keys = {}
+        for (keysym, mods), act in self._binds.iteritems():
+            release = 'release' in mods
+            mods = mods - set(['release'])
+            missing = [m for m in mods if m not in self._masks]
+            if len(missing) > 0:
+                if warn is True:
+                    _warn_bind("for '{0}'".format(act),
+                               "<{0}> isn't mapped on this display".format(
+                               missing[0].capitalize()))
+                continue
+            keycode = self.display.keysym_to_keycode(keysym)
+            if keycode == 0:
+                if warn is True:
+                    _warn_bind("for '{0}'".format(act), "its key isn't on "
+                               "this keyboard")
+                continue
+            mask = 0
+            for m in mods:
+                mask |= self._masks[m]
+            keys[(keycode, mask, release)] = act
+        return keys
 
-    def _ungrab(self):
-        for keycode, _ in self._keys.keys():
-            self.root.ungrab_key(keycode, X.AnyModifier, self.root)
+    def _read_modifiers(self):
+        self._masks = get_modifier_masks(self.display)
+        numlock = self._masks.pop('numlock', 0)
+        # Caps Lock and Num Lock shouldn't stop a hotkey from working, so
+        # every bind is also grabbed with each combination of the two, and
+        # they're ignored when matching presses
+        self._locks = set([0, X.LockMask, numlock, X.LockMask | numlock])
+        self._mod_mask = 0xff & ~(X.LockMask | numlock)
 
-    def _emit(self, key):
-        gtk.gdk.threads_enter()
-        self.emit('key-press', key)
-        gtk.gdk.threads_leave()
+    def _grab_set(self):
+        # Every (keycode, exact modifiers) combination to grab
+        # A grab gets both the press and the release
+        return set((keycode, mods | extra)
+                   for keycode, mods, release in self._keys.keys()
+                   for extra in self._locks)
+
+    def _update_grabs(self, new):
+        # Only touch grabs that changed, and send them all in one go
+        old = self._grabbed
+        for keycode, mods in old - new:
+            self.root.ungrab_key(keycode, mods)
+        for keycode, mods in new - old:
+            # Async for both pointer and keyboard: the server never waits on
+            # us, and presses that don't match a bind never reach us
+            self.root.grab_key(keycode, mods, True,
+                               X.GrabModeAsync, X.GrabModeAsync)
+        self._grabbed = new
+        if old != new:
+            self.display.flush()
+
+    def fileno(self):
+        return self.display.fileno()
+
+    def grab(self):
+        self._update_grabs(self._grab_set())
 
-    def _key_pressed_action(self, keycode, modifiers):
-        modifiers &= self._mod_mask
-        for km,act in self._keys.iteritems():
-            if keycode == km[0] and modifiers == km[1]:
-                return act
+    def ungrab(self):
+        self._update_grabs(set())
+
+    def _remap(self, event):
+        # The keyboard or modifier mapping changed (xmodmap, setxkbmap);
+        # only re-grab what actually moved. Switching between the groups of
+        # a multi-layout keymap doesn't send MappingNotify, and keysyms are
+        # found in any group of the core keymap, so binds don't follow the
+        # active group
+        self.display.refresh_keyboard_mapping(event)
+        if event.request not in (X.MappingModifier, X.MappingKeyboard):
+            return
+        # Modifier keys can move with either
+        self._read_modifiers()
+        self._keys = self._resolve_keys()
+        self._update_grabs(self._grab_set())
+
+    def _key_pressed_action(self, keycode, modifiers, release=False):
+        return self._keys.get((keycode, modifiers & self._mod_mask, release))
+
+    def read(self):
+        """Handle every pending event and return the actions pressed"""
+        acts = []
+        while self.display.pending_events() > 0:
+            event = self.display.next_event()
+            if event.type in (X.KeyPress, X.KeyRelease):
+                act = self._key_pressed_action(event.detail, event.state,
+                                               event.type == X.KeyRelease)
+                if act is not None:
+                    acts.append(act)
+            elif event.type == X.MappingNotify:
+                self._remap(event)
+        return acts
+
+    def close(self):
+        self.ungrab()
+        self.display.close()
+
+class HotKeyListener(_Listener, DisplayKeys):
+    def __init__(self, keybinds, display=None):
+        _Listener.__init__(self)
+        try:
+            DisplayKeys.__init__(self, keybinds, display)
+        except Exception:
+            # Couldn't connect; run() will never close the wake pipe
+            self._close_wake()
+            raise
 
     def run(self):
-        self._running = True
-        self._grab()
+        # Stopped before it started: just clean up
+        if self._running is True:
+            self.grab()
+            # Only ready once the server has the grabs
+            self.display.sync()
+            self.ready.set()
         while self._running is True:
             # Wait for new events
-            select.select([self.display], [], [], 1)
-            # Pump events
-            while self.display.pending_events() > 0:
-                event = self.display.next_event()
-                if event.type == X.KeyPress:
-                    act = self._key_pressed_action(event.detail, event.state)
-                    if act is not None:
-                        gobject.idle_add(self._emit, act)
-                        self.display.allow_events(X.AsyncKeyboard, event.time)
-                    else:
-                        self.display.allow_events(X.ReplayKeyboard, event.time)
-        self.display.close()
+            self._wait([self.display])
+            for act in self.read():
+                gobject.idle_add(self._emit, act)
+        # Only this thread ever touches the display
+        self.close()
+        self._close_wake()
 
-    def stop(self):
-        self._ungrab()
-        self._running = False
+class EvdevHotKeyListener(_Listener):
+    """Reads key events straight from the kernel's event devices
+
+    Raises OSError if none of the devices can be opened.
+    """
+    def __init__(self, keybinds, devices=None):
+        _Listener.__init__(self)
+        if devices is None: devices = get_evdev_devices()
+        self._keys = {}
+        self._mods = {}
+        # Parse and load the keybinds:
+        for act, key in keybinds.iteritems():
+            km = parse_evdev_key(key)
+            if km is not None:
+                self._keys[km] = act
+        # Open every device we're allowed to read from
+        self._fds = {}
+        error = None
+        for path in devices:
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if error is None: error = e
+                continue
+            self._fds[fd] = ''
+        if len(self._fds) > 0: return
+        # Nothing to listen to; run() would just end
+        self._close_wake()
+        if error is None:
+            raise OSError(errno.ENOENT, "No input devices found")
+        if error.errno == errno.EACCES:
+            raise OSError(error.errno, "Can't read the input devices (is "
+                          "the user in the 'input' group?)", error.filename)
+        raise error
+
+    def _key_pressed_action(self, keycode, release=False):
+        mods = set(m for m, n in self._mods.iteritems() if n > 0)
+        if release is True:
+            mods.add('release')
+        return self._keys.get((keycode, frozenset(mods)))
+
+    def _handle(self, ev_type, code, value):
+        if ev_type != _EV_KEY: return
+        if code in _evdev_modifiers:
+            mod = _evdev_modifiers[code]
+            if value == _KEY_PRESS:
+                self._mods[mod] = self._mods.get(mod, 0) + 1
+            elif value == _KEY_RELEASE:
+                self._mods[mod] = max(self._mods.get(mod, 0) - 1, 0)
+        else:
+            act = self._key_pressed_action(code, value == _KEY_RELEASE)
+            if act is not None:
+                gobject.idle_add(self._emit, act)
+
+    def _read(self, fd):
+        # Drain everything the device has for us without blocking
+        while True:
+            try:
+                data = os.read(fd, _EV_SIZE * 64)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return True
+                # The device went away
+                return False
+            if len(data) == 0:
+                # EOF; only seen on stand-ins like FIFOs, never on real devices
+                return False
+            data = self._fds[fd] + data
+            end = len(data) - len(data) % _EV_SIZE
+            for off in range(0, end, _EV_SIZE):
+                _, _, ev_type, code, value = struct.unpack_from(_EV_FORMAT,
+                                                                data, off)
+                self._handle(ev_type, code, value)
+            self._fds[fd] = data[end:]
+
+    def run(self):
+        self.ready.set()
+        while self._running is True and len(self._fds) > 0:
+            for fd in self._wait(self._fds.keys()):
+                if fd == self._wake_r:
+                    continue
+                if self._read(fd) is False:
+                    os.close(fd)
+                    del self._fds[fd]
+        for fd in self._fds.keys():
+            os.close(fd)
+        self._fds.clear()
+        self._close_wake()
 
 # vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
@@ -0,0 +1,470 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+import sys
+import mmap
+import time
+import socket
+import threading
+from optparse import OptionParser
+import gobject
+import pyvolwheel
+from pyvolwheel import config,mixer,hotkeys,trace,worker,snapshot
+from pyvolwheel import scheduler,status,profiling
+
+def discover(cfg):
+    """Fill in any of cfg's driver, device and control that aren't set"""
+    # If no driver is set, pick the first one available
+    if cfg.driver is None:
+        # Use the first driver returned by mixer.get_drivers()
+        cfg.driver = mixer.get_drivers()[0]
+        # Device & control are considered invalid
+        cfg.device = None
+        cfg.control = None
+    # If no device is given, use the first one in the list
+    if cfg.device is None:
+        cfg.device = mixer.get_devices(cfg.driver)[0]
+    else:
+        # Convert device to an int if possible (for ALSA card index)
+        try:
+            cfg.device = int(cfg.device)
+        except ValueError:
+            pass
+    # If not control was given, use the first one in the control list
+    if cfg.control is None:
+        cfg.control = mixer.get_controls(cfg.driver, cfg.device)[0]
+
+class Main(object):
+    def __init__(self, options, profiler):
+        self.options = options
+        self.profiler = profiler
+        # Exit status
+        self.status = 0
+        self.recorder = None
+        if options.record is not None:
+            self.recorder = trace.Recorder(options.record)
+
+    def on_hotkey_press(self, obj, key):
+        if key in ['up', 'down']:
+            self.change_volume(key)
+        elif key == 'mute':
+            self.toggle_mute()
+        elif key.startswith('profile:'):
+            self.apply_profile(key[len('profile:'):])
+        return True
+
+    def _on_first_idle(self):
+        # The main loop is up; startup is over
+        prof = self.profiler
+        prof.add('startup', time.time() - prof.started)
+        # The icon gets drawn once the main loop runs
+        prof.add('time to icon', prof.last['startup'])
+        prof.print_breakdown("Time to", ('time to volume', 'time to icon',
+                                         'time to hotkeys'))
+        if self.options.check_budget is True:
+            if self._check_budget() is False:
+                self.status = 1
+            self.ui.quit_main_loop()
+        elif prof.mode == 'startup':
+            prof.stop()
+        elif prof.mode == 'run':
+            prof.start()
+            self.scheduler.add(self.options.profile_time,
+                               self._on_profile_done, slack=0)
+        return False
+
+    def _start_publisher(self):
+        try:
+            self.publisher = status.StatusPublisher()
+            started = self.publisher.start()
+        except (socket.error, OSError) as e:
+            print >> sys.stderr, "Status socket disabled: " + str(e)
+            started = False
+        else:
+            if started is False:
+                print >> sys.stderr, ("Status socket disabled: another "
+                                      "instance is already publishing")
+        if started is False:
+            self.publisher = None
+
+    def _check_budget(self):
+        # Returns False if any target was missed
+        problems = self.ui.check_budget(self.profiler.last['startup'])
+        if len(problems) == 0:
+            print >> sys.stderr, "Headless startup is within budget"
+        for problem in problems:
+            print >> sys.stderr, "Headless startup over budget: " + problem
+        return len(problems) == 0
+
+    def _on_profile_done(self):
+        self.profiler.stop()
+        print >> sys.stderr, "Timer wakeups in the last minute: {0}".format(
+                             self.scheduler.wakeups_per_minute())
+        return False
+
+    def run(self):
+        prof = self.profiler
+        # Worker and hotkey threads start before the UI is even imported
+        gobject.threads_init()
+        # All periodic work goes through this
+        self.scheduler = scheduler.Scheduler()
+        with prof.phase('config'):
+            self.config = config.Config(self.options.config)
+        self.mixer = None
+        self.worker = None
+        # Last known (control, level, muted) of the mixer, and the level of
+        # each channel
+        self.state = None
+        self.levels = ()
+        self.icon = None
+        self.publisher = None
+        self.page = None
+        self.hkl = None
+        # Bumped whenever a pending hotkey listener becomes stale
+        self._hkl_gen = 0
+        # Connecting to X doesn't depend on the mixer; let it run alongside
+        # discovery and the GUI imports
+        if self.config.hotkeys.enabled is True:
+            self._respawn_hkl()
+        # Get the volume right first, everything else can wait
+        try:
+            with prof.phase('discovery'):
+                self._discover()
+            with prof.phase('open mixer'):
+                self._open_mixer()
+        except mixer.MixerError as e:
+            print "Error: " + str(e)
+            sys.exit(255)
+        with prof.phase('restore'):
+            if self.config.restore.enabled is True:
+                self.worker.set_mute(self.config.restore.muted)
+                self.worker.set_volume(self.config.restore.level)
+            else:
+                # Still have the worker read the real state early
+                self.worker.refresh()
+        # The worker applies the restore while the GUI loads
+        if self.options.headless is True:
+            from pyvolwheel import headless as ui
+        else:
+            with prof.phase('gui imports'):
+                from pyvolwheel import gui as ui
+        self.ui = ui
+        ui.threads_init()
+        with prof.phase('tray icon'):
+            self.icon = ui.TrayIcon(self)
+            self.icon.reload()
+        if self.config.status.socket is True:
+            with prof.phase('status socket'):
+                self._start_publisher()
+        if self.config.status.page is True:
+            try:
+                self.page = status.StatusPageWriter()
+            except (EnvironmentError, mmap.error) as e:
+                print >> sys.stderr, "Status page disabled: " + str(e)
+        prof.print_breakdown("Startup", ('imports', 'config', 'discovery',
+                                         'open mixer', 'restore',
+                                         'gui imports', 'tray icon',
+                                         'status socket'))
+        gobject.idle_add(self._on_first_idle)
+        try:
+            ui.run_main_loop()
+        except KeyboardInterrupt:
+            pass
+        # Stop the hotkey listener, if it's active
+        self._kill_hkl()
+        if self.publisher is not None:
+            self.publisher.close()
+        if self.page is not None:
+            self.page.close()
+        # The mixer is ours again once the worker is gone; leave it alone
+        # if the device is hung
+        if self._stop_worker() is False:
+            return
+        if self.config.restore.enabled is True:
+            try:
+                self.config.restore.level = self.mixer.get_volume()[0]
+                self.config.restore.muted = self.mixer.get_mute()
+            except mixer.MixerError:
+                pass
+            else:
+                self.config.save()
+        # Give the device handles back to the driver
+        self.mixer.close()
+        mixer.release_handles()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def on_mixer_state(self, state, error):
+        # The worker reports back; this is the real state of the device
+        if 'time to volume' not in self.profiler.last:
+            # The first report comes after the restore has been applied
+            self.profiler.add('time to volume',
+                              time.time() - self.profiler.started)
+        with self.profiler.phase('state update'):
+            if error is not None:
+                self.icon.set_error(error)
+                if self.publisher is not None:
+                    self.publisher.publish_error(error)
+                if self.page is not None:
+                    self.page.set_error()
+            else:
+                self._show(*state)
+        return False
+
+    def _show(self, control, level, muted, levels=None):
+        if levels is None:
+            # Predicted; assume all channels end up at the same level
+            levels = (level,) * max(len(self.levels), 1)
+        self.state = (control, level, muted)
+        self.levels = levels
+        self.icon.set_level(control, level, muted)
+        if self.publisher is not None:
+            self.publisher.publish(control, level, muted)
+        if self.page is not None:
+            self.page.update(control, levels, muted)
+
+    def _predict(self, control, level, muted):
+        # Show the expected result right away, on_mixer_state() corrects it
+        self._show(control, level, muted)
+
+    def toggle_mute(self):
+        if self.worker is None: return
+        self.worker.toggle_mute()
+        if self.state is not None:
+            control, level, muted = self.state
+            self._predict(control, level, not muted)
+
+    def set_volume(self, level):
+        if self.worker is None: return
+        self.worker.set_volume(level)
+        if self.state is not None:
+            control, _, muted = self.state
+            self._predict(control, mixer._clamp(level), muted)
+
+    def change_volume(self, direction):
+        if self.worker is None: return
+        if direction == 'up':
+            inc = self.config.mixer.increment
+        elif direction == 'down':
+            inc = -self.config.mixer.increment
+        else:
+            return
+        self.worker.change_volume(inc)
+        if self.state is not None:
+            control, level, muted = self.state
+            self._predict(control, mixer._clamp(level + inc), muted)
+
+    def apply_profile(self, name):
+        if self.worker is None: return
+        try:
+            snap = snapshot.load(name)
+        except (IOError, ValueError) as e:
+            self.icon.set_error("Profile '{0}': {1}".format(name, str(e)))
+            return
+        self.worker.call(lambda: snapshot.apply(snap))
+
+    def save_profile(self, name):
+        if self.worker is None: return
+        driver = self.config.mixer.driver
+        device = self.config.mixer.device
+        def on_captured(snap):
+            try:
+                snapshot.save(name, snap)
+            except (IOError, OSError, ValueError) as e:
+                self.icon.set_error("Profile '{0}': {1}".format(name, str(e)))
+            return False
+        # Capturing reads every control, so it belongs on the worker too
+        self.worker.call(lambda: snapshot.capture(driver, device),
+                         on_captured)
+
+    def _stop_worker(self):
+        # Returns False if the worker is stuck in a device call
+        if self.worker is None: return True
+        self.worker.stop()
+        self.worker.join(self.worker.timeout)
+        stopped = not self.worker.is_alive()
+        self.worker = None
+        return stopped
+
+    def _respawn_hkl(self):
+        self._kill_hkl()
+        binds = {  'up': self.config.hotkeys.up,
+                 'down': self.config.hotkeys.down,
+                 'mute': self.config.hotkeys.mute}
+        # Hotkeys for profiles, "name=key,name=key"
+        for pair in self.config.hotkeys.profiles.split(','):
+            if '=' not in pair: continue
+            name, key = pair.split('=', 1)
+            binds['profile:' + name.strip()] = key.strip()
+        # Start the hotkey listener
+        if self.config.hotkeys.backend == 'evdev':
+            if hotkeys.evdev_available is False: return
+            cls = hotkeys.EvdevHotKeyListener
+        else:
+            if hotkeys.available is False: return
+            cls = hotkeys.HotKeyListener
+        gen = self._hkl_gen
+        def connect():
+            # Opening the display (or the input devices) can block for a
+            # while, keep it off the main thread
+            try:
+                hkl = cls(binds)
+            except Exception as e:
+                # No display, connection refused, ...; nobody would see a
+                # traceback from this thread
+                gobject.idle_add(self._on_hkl_error, str(e) or
+                                 type(e).__name__, gen)
+                return
+            gobject.idle_add(self._on_hkl_ready, hkl, gen)
+        t = threading.Thread(target=connect, name='hotkey connect')
+        t.daemon = True
+        t.start()
+
+    def _on_hkl_ready(self, hkl, gen):
+        if gen != self._hkl_gen:
+            # Reloaded or shut down in the meantime; let it clean up after
+            # itself without ever listening
+            hkl.stop()
+            hkl.start()
+            return False
+        self.hkl = hkl
+        self.hkl.connect('key-press', self.on_hotkey_press)
+        if self.recorder is not None:
+            self.recorder.watch(self.hkl)
+        self.hkl.start()
+        if 'time to hotkeys' not in self.profiler.last:
+            self.profiler.add('time to hotkeys',
+                              time.time() - self.profiler.started)
+        return False
+
+    def _on_hkl_error(self, error, gen):
+        if gen == self._hkl_gen:
+            self.icon.set_error("Hotkeys disabled: " + error)
+        return False
+
+    def _kill_hkl(self):
+        # Any listener still connecting is stale now
+        self._hkl_gen += 1
+        if self.hkl is None:
+            return
+        self.hkl.stop()
+        # It exits as soon as stop() wakes it; don't leave it (and its
+        # display connection) behind
+        self.hkl.join()
+        self.hkl = None
+
+    def reload(self):
+        # Reload mixer etc to reflect any changes in self.config
+        prof = self.profiler
+        with prof.phase('discovery'):
+            self._discover()
+        with prof.phase('open mixer'):
+            self._open_mixer()
+        # Kill or respawn the hotkey listener
+        with prof.phase('hotkeys'):
+            if self.config.hotkeys.enabled is True:
+                self._respawn_hkl()
+            else:
+                self._kill_hkl()
+        # Make the tray icon reload
+        with prof.phase('icon reload'):
+            self.icon.reload()
+        prof.print_breakdown("Reload", ('discovery', 'open mixer', 'hotkeys',
+                                        'icon reload'))
+
+    def _discover(self):
+        discover(self.config.mixer)
+
+    def _new_mixer(self):
+        return mixer.open_mixer(self.config.mixer.driver,
+                                self.config.mixer.device,
+                                self.config.mixer.control)
+
+    def _open_mixer(self):
+        # Close the current mixer, if one's open (it stays in the handle pool,
+        # so reopening the same control is free)
+        if self._stop_worker() is False:
+            # Abandon the hung device to its worker; the new mixer gets a
+            # fresh handle
+            self.mixer.abandon()
+            self.mixer = None
+        if self.mixer is not None:
+            self.mixer.close()
+            self.mixer = None
+        self.state = None
+        # Open the new mixer
+        self.mixer = self._new_mixer()
+        if self.recorder is not None:
+            self.mixer = self.recorder.wrap(self.mixer)
+        # From here on only the worker talks to the mixer
+        self.worker = worker.MixerWorker(self.mixer, self.on_mixer_state,
+                                         self.config.mixer.timeout / 1000.0)
+        self.worker.start()
+
+def parse_args(argv):
+    parser = OptionParser(usage="%prog [options]",
+                          version="%prog " + pyvolwheel.__version__)
+    parser.add_option("-V", action="version",
+                      help="show program's version number and exit")
+    parser.add_option("--config", metavar="FILE",
+                      help="use FILE instead of the default config file")
+    parser.add_option("--headless", action="store_true", default=False,
+                      help="run without GTK or a tray icon (mixer, restore "
+                           "and hotkeys only)")
+    parser.add_option("--profile", choices=profiling.modes,
+                      metavar="startup|run",
+                      help="profile startup (the default) or a window of the "
+                           "running main loop and write the results to the "
+                           "runtime directory")
+    parser.add_option("--profile-time", type="int", default=30,
+                      metavar="SECONDS",
+                      help="length of the --profile=run window "
+                           "[default: %default]")
+    parser.add_option("--record", metavar="FILE",
+                      help="record a trace of all mixer operations to FILE "
+                           "(replay with 'python -m pyvolwheel.trace')")
+    parser.add_option("--check-budget", action="store_true", default=False,
+                      help="with --headless: quit once started, with status "
+                           "1 if startup missed its memory or time target")
+    # --profile takes an optional value, which optparse can't express
+    argv = ['--profile=startup' if a == '--profile' else a for a in argv]
+    options = parser.parse_args(argv)[0]
+    if options.check_budget is True:
+        if options.headless is False:
+            parser.error("--check-budget needs --headless")
+        if options.profile is not None:
+            # The profiler would inflate both numbers
+            parser.error("--check-budget can't be combined with --profile")
+    return options
+
+def main(argv, profiler=None):
+    options = parse_args(argv)
+    if profiler is None:
+        profiler = profiling.Profiler(options.profile)
+    app = Main(options, profiler)
+    app.run()
+    return app.status
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
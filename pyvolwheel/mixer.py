@@ -23,6 +23,12 @@
 #
 
 import os
+import math
+import fcntl
+import struct
+import bisect
+import threading
+import collections
 # Try importing the driver modules
 available_drivers = []
 try:
@@ -69,13 +75,17 @@ def get_controls(driver, device):
         # Filter out the controls that can't control the volume
         valid = []
         for c in alsaaudio.mixers():
+            # Never probe a handle in use: it may be the mixer worker's
             try:
-                m = alsaaudio.Mixer(c, cardindex=dev)
-                if len(m.volumecap()) > 0:
+                m = _pool.borrow(driver, dev, c)
+            except (MixerError, ValueError):
+                continue
+            try:
+                if len(m._mixer.volumecap()) > 0:
                     valid.append(c)
-                m.close()
             except alsaaudio.ALSAAudioError:
                 pass
+            _pool.give_back(m)
     elif driver == "OSS":
         try:
             om = ossaudiodev.openmixer(device)
@@ -93,6 +103,14 @@ def get_controls(driver, device):
         return valid
 
 def open_mixer(driver, device, control):
+    """Return a (pooled) mixer; close() hands it back to the pool"""
+    return _pool.acquire(driver, device, control)
+
+def release_handles():
+    """Close every pooled mixer handle that isn't in use"""
+    _pool.clear()
+
+def _open_mixer(driver, device, control):
     if driver not in available_drivers:
         raise MixerError("Invalid driver: '{0}'".format(str(driver)))
     elif driver == 'ALSA':
@@ -100,10 +118,122 @@ def open_mixer(driver, device, control):
     elif driver == 'OSS':
         return OSSMixer(device, control)
 
+class MixerPool(object):
+    """Keeps mixer handles open so they can be reused
+
+    Handles are keyed by (driver, device, control). A handle in use is shared
+    between everyone who acquired it; once released it stays open until it
+    falls off the end of the LRU list of idle handles. Safe to use from
+    several threads.
+    """
+    def __init__(self, size=16):
+        self.size = size
+        # key -> mixer, least recently used first
+        self._idle = collections.OrderedDict()
+        # key -> [mixer, refcount]
+        self._busy = {}
+        # Reentrant: a Mixer.__del__ can release into the pool while it's
+        # held
+        self._lock = threading.RLock()
+
+    def _key(self, driver, device, control):
+        if driver not in available_drivers:
+            raise MixerError("Invalid driver: '{0}'".format(str(driver)))
+        if driver == 'ALSA':
+            device = _alsa_device_to_idx(device)
+        elif driver == 'OSS' and device is None:
+            device = get_devices('OSS')[0]
+        return driver, device, control
+
+    def _take(self, key, driver, device, control):
+        # An idle handle or a new one, owned by nobody yet
+        if key in self._idle:
+            return self._idle.pop(key)
+        m = _open_mixer(driver, device, control)
+        m._pool = self
+        m._pool_key = key
+        return m
+
+    def acquire(self, driver, device, control):
+        key = self._key(driver, device, control)
+        with self._lock:
+            if key in self._busy:
+                self._busy[key][1] += 1
+                return self._busy[key][0]
+            m = self._take(key, driver, device, control)
+            self._busy[key] = [m, 1]
+            return m
+
+    def borrow(self, driver, device, control):
+        """Return a handle nobody else is using, for a quick probe
+
+        Unlike acquire() this never shares a handle that's in use (which
+        may belong to another thread); give it back with give_back().
+        """
+        key = self._key(driver, device, control)
+        with self._lock:
+            if key in self._busy:
+                m = _open_mixer(driver, device, control)
+                m._pool_key = key
+                return m
+            return self._take(key, driver, device, control)
+
+    def give_back(self, m):
+        with self._lock:
+            key = m._pool_key
+            if key in self._busy or key in self._idle:
+                # Someone opened it meanwhile; this copy isn't needed
+                m._close_handle()
+                return
+            m._pool = self
+            self._idle[key] = m
+            self._trim(self.size)
+
+    def release(self, m):
+        with self._lock:
+            if self._idle.get(m._pool_key) is m:
+                # Already released; it's idle, not ours to close
+                return
+            entry = self._busy.get(m._pool_key)
+            if entry is None or entry[0] is not m:
+                # Not one of ours (anymore)
+                m._close_handle()
+                return
+            entry[1] -= 1
+            if entry[1] > 0: return
+            del self._busy[m._pool_key]
+            self._idle[m._pool_key] = m
+            self._trim(self.size)
+
+    def forget(self, m):
+        """Stop handing out m, leaving it open to whoever still has it
+
+        For handles stuck in a device call: the next acquire() opens a fresh
+        handle instead of sharing the stuck one.
+        """
+        with self._lock:
+            entry = self._busy.get(m._pool_key)
+            if entry is not None and entry[0] is m:
+                del self._busy[m._pool_key]
+            m._pool = None
+
+    def _trim(self, size):
+        with self._lock:
+            while len(self._idle) > size:
+                _, m = self._idle.popitem(last=False)
+                m._close_handle()
+
+    def clear(self):
+        self._trim(0)
+
+_pool = MixerPool()
+
 class Mixer(object):
     def __init__(self):
         self._mixer = None
         self._mute_cache = None
+        self._pool = None
+        self._pool_key = None
 
     def __del__(self):
         self.close()
@@ -112,7 +242,28 @@ class Mixer(object):
         if self._mixer is None:
             raise MixerError("Device is closed")
 
+    def changed(self):
+        """Return False only if the device certainly hasn't changed since the
+        last call (drivers that can't tell cheaply always return True)"""
+        return True
+
     def close(self):
+        if self._pool is not None:
+            self._pool.release(self)
+        else:
+            self._close_handle()
+
+    def abandon(self):
+        """Give up on a handle that's stuck in a device call
+
+        The handle stays open for the thread stuck in it, but open_mixer()
+        won't hand it out again.
+        """
+        if self._pool is not None:
+            self._pool.forget(self)
+
+    def _close_handle(self):
+        self._pool = None
         if self._mixer is not None:
             self._mixer.close()
             self._mixer = None
@@ -142,6 +293,10 @@ class Mixer(object):
         else:
             return True
 
+# pyalsaaudio >= 0.9 can work in raw and dB units instead of percent
+alsa_exact_steps = ('ALSA' in available_drivers and
+                    hasattr(alsaaudio, 'VOLUME_UNITS_RAW'))
+
 if 'ALSA' in available_drivers:
     def _alsa_device_to_idx(device):
         if isinstance(device, str) or isinstance(device, unicode):
@@ -158,6 +313,61 @@ if 'ALSA' in available_drivers:
             raise MixerError("Invalid device '{0}'".format(str(device)))
         return idx
 
+    # Ranges wider than this many dB get alsamixer's logarithmic mapping
+    _MAX_LINEAR_DB_SCALE = 24
+    # SND_CTL_TLV_DB_GAIN_MUTE: the minimum of a control whose lowest step
+    # mutes, in hundredths of a dB
+    _DB_GAIN_MUTE = -9999999
+
+    def _alsa_volume_table(mixer):
+        """Return (units, table) where table[percent] is the native value"""
+        if not alsa_exact_steps: return None
+        try:
+            rmin, rmax = mixer.getrange(units=alsaaudio.VOLUME_UNITS_RAW)
+        except (alsaaudio.ALSAAudioError, TypeError):
+            return None
+        if rmax <= rmin: return None
+        try:
+            # Hundredths of a dB
+            dmin, dmax = mixer.getrange(units=alsaaudio.VOLUME_UNITS_DB)
+        except (alsaaudio.ALSAAudioError, TypeError):
+            dmin = dmax = 0
+        if dmax <= dmin:
+            # No dB information; linear in raw units
+            return alsaaudio.VOLUME_UNITS_RAW, [
+                int(round(rmin + (rmax - rmin) * p / 100.0))
+                for p in range(101)]
+        # Percent to dB the way alsamixer does it. The driver rounds each
+        # dB value to the nearest raw step, whatever the control's dB
+        # scale looks like
+        if dmax - dmin <= _MAX_LINEAR_DB_SCALE * 100:
+            table = [int(round(dmin + (dmax - dmin) * p / 100.0))
+                     for p in range(101)]
+        else:
+            # Perceptually even steps. A mute floor isn't a real minimum to
+            # normalise against, so it's left out
+            if dmin <= _DB_GAIN_MUTE:
+                min_norm = 0.0
+            else:
+                min_norm = math.pow(10, (dmin - dmax) / 6000.0)
+            table = [dmin]
+            for p in range(1, 101):
+                table.append(int(round(6000 * math.log10(
+                    p / 100.0 * (1 - min_norm) + min_norm))) + dmax)
+        table[0], table[100] = dmin, dmax
+        return alsaaudio.VOLUME_UNITS_DB, table
+
+    def _table_to_percent(table, value):
+        # Closest percentage for a native value; of several percentages
+        # on the same step, the highest, so 100% reads back as 100%
+        i = bisect.bisect_right(table, value)
+        if i > 0 and table[i - 1] == value: return i - 1
+        if i <= 0: return 0
+        if i >= len(table): return len(table) - 1
+        if table[i] - value <= value - table[i - 1]:
+            return i
+        return i - 1
+
     class ALSAMixer(Mixer):
         """A very simple ALSA mixer class"""
         def __init__(self, device=0, control=None):
@@ -169,6 +379,25 @@ if 'ALSA' in available_drivers:
                 self._mixer = alsaaudio.Mixer(control, cardindex=self._device)
             except alsaaudio.ALSAAudioError as ae:
                 raise MixerError("Error opening mixer: {0}".format(str(ae)))
+            # Percent <-> raw/dB lookup table, None if we're stuck with
+            # alsaaudio's own (rounding) percent conversion
+            table = _alsa_volume_table(self._mixer)
+            if table is None:
+                self._units, self._table = None, None
+            else:
+                self._units, self._table = table
+
+        def _get_native(self):
+            return self._mixer.getvolume(units=self._units)
+
+        def _get_raw(self):
+            return self._mixer.getvolume(units=alsaaudio.VOLUME_UNITS_RAW)
+
+        def _set_percent(self, volume):
+            if self._table is None:
+                self._mixer.setvolume(volume)
+            else:
+                self._mixer.setvolume(self._table[volume], units=self._units)
 
         def get_device(self):
             #self._check_mixer()
@@ -179,17 +408,55 @@ if 'ALSA' in available_drivers:
 
         def get_volume(self):
             self._check_mixer()
-            return self._mixer.getvolume()
+            if self._table is None:
+                return self._mixer.getvolume()
+            return [_table_to_percent(self._table, v)
+                    for v in self._get_native()]
 
         def set_volume(self, volume):
             self._check_mixer()
-            volume = _clamp(volume)
-            self._mixer.setvolume(volume)
+            self._set_percent(int(_clamp(volume)))
+
+        def set_channels(self, levels):
+            """Set the level of each channel separately"""
+            self._check_mixer()
+            for channel, volume in enumerate(levels):
+                volume = int(_clamp(volume))
+                try:
+                    if self._table is None:
+                        self._mixer.setvolume(volume, channel)
+                    else:
+                        self._mixer.setvolume(self._table[volume], channel,
+                                              units=self._units)
+                except alsaaudio.ALSAAudioError as ae:
+                    raise MixerError(str(ae))
 
         def change_volume(self, delta):
             self._check_mixer()
-            cur_vol = self._mixer.getvolume()
-            self._mixer.setvolume(_clamp(cur_vol[0] + delta))
+            if self._table is None:
+                cur_vol = self._mixer.getvolume()
+                self._mixer.setvolume(_clamp(cur_vol[0] + delta))
+                return
+            native = self._get_native()[0]
+            cur = _table_to_percent(self._table, native)
+            new = int(_clamp(cur + delta))
+            step = 1 if delta > 0 else -1
+            if self._units == alsaaudio.VOLUME_UNITS_RAW:
+                # Controls with fewer steps than 100 map several
+                # percentages to the same value; skip to one that differs
+                while (delta != 0 and 0 < new < 100 and
+                       self._table[new] == self._table[cur]):
+                    new += step
+                self._set_percent(new)
+                return
+            # Several dB values can round to the step we're on; keep going
+            # until the raw value actually moves
+            before = self._get_raw()[0]
+            self._set_percent(new)
+            while (delta != 0 and 0 < new < 100 and
+                   self._get_raw()[0] == before):
+                new += step
+                self._set_percent(new)
 
         def get_mute(self):
             self._check_mixer()
@@ -209,6 +476,14 @@ if 'ALSA' in available_drivers:
                 self._set_fake_mute(flag)
 
 if 'OSS' in available_drivers:
+    # struct mixer_info {char id[16]; char name[32]; int modify_counter;
+    #                    int fillers[10];}
+    _MIXER_INFO_SIZE = 16 + 32 + 4 + 40
+    _MIXER_INFO_COUNTER = 48
+    # _IOR('M', 101, mixer_info)
+    _SOUND_MIXER_INFO = ((2 << 30) | (_MIXER_INFO_SIZE << 16) |
+                         (ord('M') << 8) | 101)
+
     class OSSMixer(Mixer):
         """A very simple OSS mixer class"""
         def __init__(self, device=None, control='Vol'):
@@ -228,6 +503,32 @@ if 'OSS' in available_drivers:
             # Set the control
             self._control = control
             self._control_idx = self._control_to_idx(control)
+            # The driver bumps modify_counter on every change, so levels only
+            # need to be read when it moves
+            self._info_supported = True
+            self._vol_cache = None
+            self._vol_counter = None
+            self._seen_counter = None
+
+        def _modify_counter(self):
+            # None if the driver doesn't support SOUND_MIXER_INFO
+            if self._info_supported is False: return None
+            try:
+                info = fcntl.ioctl(self._mixer.fileno(), _SOUND_MIXER_INFO,
+                                   '\0' * _MIXER_INFO_SIZE)
+            except IOError:
+                self._info_supported = False
+                return None
+            return struct.unpack_from('i', info, _MIXER_INFO_COUNTER)[0]
+
+        def changed(self):
+            self._check_mixer()
+            counter = self._modify_counter()
+            if counter is None:
+                return True
+            changed = counter != self._seen_counter
+            self._seen_counter = counter
+            return changed
 
         def _control_to_idx(self, control):
             """Returns the integer value of the control string"""
@@ -253,12 +554,16 @@ if 'OSS' in available_drivers:
             self._check_mixer()
             if self._mute_cache is not None:
                 return self._mute_cache
+            counter = self._modify_counter()
+            if counter is not None and counter == self._vol_counter:
+                return self._vol_cache
             try:
                 vol = self._mixer.get(self._control_idx)
             except ossaudiodev.OSSAudioError as e:
                 raise MixerError(str(e))
             except IOError as e:
                 raise MixerError("Unsupported control: " + self._control)
+            self._vol_cache, self._vol_counter = vol, counter
             return vol
 
         def set_volume(self, volume):
@@ -268,11 +573,28 @@ if 'OSS' in available_drivers:
             if self._mute_cache is not None:
                 self._mute_cache = (volume, volume)
                 return
+            self._write((volume, volume))
+
+        def _write(self, levels):
+            # Our own write moves the modify counter too
+            self._vol_counter = None
             try:
-                self._mixer.set(self._control_idx, (volume, volume))
+                self._mixer.set(self._control_idx, levels)
             except ossaudiodev.OSSAudioError as e:
                 raise MixerError(str(e))
 
+        def set_channels(self, levels):
+            """Set the level of the left and right channel separately"""
+            self._check_mixer()
+            levels = tuple(_clamp(v) for v in levels)
+            if len(levels) == 1:
+                levels = levels * 2
+            levels = levels[:2]
+            if self._mute_cache is not None:
+                self._mute_cache = levels
+                return
+            self._write(levels)
+
         def change_volume(self, delta):
             self._check_mixer()
             # If the control is muted, update the mute cache and return
@@ -282,11 +604,8 @@ if 'OSS' in available_drivers:
                                     _clamp(cur_vol[1] + delta))
                 return
             cur_vol = self.get_volume()
-            try:
-                self._mixer.set(self._control_idx,(_clamp(cur_vol[0] + delta),
-                                                   _clamp(cur_vol[1] + delta)))
-            except ossaudiodev.OSSAudioError as e:
-                raise MixerError(str(e))
+            self._write((_clamp(cur_vol[0] + delta),
+                         _clamp(cur_vol[1] + delta)))
 
         def set_mute(self, flag):
             self._check_mixer()
@@ -0,0 +1,133 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+# Wall time per phase of startup and the main loop, plus an optional cProfile
+# run (--profile=startup or --profile=run).
+
+import os
+import sys
+import time
+import cProfile
+import pstats
+from contextlib import contextmanager
+from pyvolwheel.config import get_runtime_dir
+
+modes = ('startup', 'run')
+
+def mode_from_argv(argv):
+    """Return the --profile mode given in argv (None if not given)
+
+    This is read before the options are parsed so the imports can be
+    profiled too.
+    """
+    for arg in argv[1:]:
+        if arg == '--profile':
+            return 'startup'
+        elif arg.startswith('--profile='):
+            return arg.split('=', 1)[1]
+    return None
+
+class Profiler(object):
+    def __init__(self, mode=None):
+        if mode is not None and mode not in modes:
+            raise ValueError("Invalid profile mode '{0}'".format(mode))
+        self.mode = mode
+        self.enabled = mode is not None
+        # name -> [count, total, max]
+        self.phases = {}
+        # name -> duration of the last run
+        self.last = {}
+        self._order = []
+        self._prof = None
+        self.started = time.time()
+        if mode == 'startup':
+            self.start()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def add(self, name, duration):
+        if name not in self.phases:
+            self.phases[name] = [0, 0.0, 0.0]
+            self._order.append(name)
+        p = self.phases[name]
+        p[0] += 1
+        p[1] += duration
+        p[2] = max(p[2], duration)
+        self.last[name] = duration
+
+    def breakdown(self, title, names):
+        """Return the last wall time of each of the named phases"""
+        lines = ["{0}:".format(title)]
+        total = 0.0
+        for name in names:
+            if name not in self.last: continue
+            total += self.last[name]
+            lines.append("  {0:<20} {1:8.2f} ms".format(name,
+                                                       1000 * self.last[name]))
+        lines.append("  {0:<20} {1:8.2f} ms".format("total", 1000 * total))
+        return "\n".join(lines)
+
+    def print_breakdown(self, title, names):
+        if self.enabled is False: return
+        print >> sys.stderr, self.breakdown(title, names)
+
+    def summary(self):
+        lines = ["{0:<20} {1:>7} {2:>11} {3:>11} {4:>11}".format(
+                 "phase", "count", "total ms", "mean ms", "max ms")]
+        for name in self._order:
+            count, total, longest = self.phases[name]
+            lines.append("{0:<20} {1:7d} {2:11.2f} {3:11.2f} {4:11.2f}".format(
+                         name, count, 1000 * total, 1000 * total / count,
+                         1000 * longest))
+        return "\n".join(lines)
+
+    def start(self):
+        self._prof = cProfile.Profile()
+        self._prof.enable()
+
+    def stop(self):
+        """Stop profiling, write the results and return their paths"""
+        if self._prof is None: return None
+        self._prof.disable()
+        base = os.path.join(get_runtime_dir(), "profile-{0}-{1}".format(
+                            self.mode, os.getpid()))
+        self._prof.dump_stats(base + ".prof")
+        with open(base + ".txt", 'w') as f:
+            f.write(self.summary() + "\n\n")
+            stats = pstats.Stats(base + ".prof", stream=f)
+            stats.sort_stats('cumulative').print_stats(40)
+        self._prof = None
+        print >> sys.stderr, self.summary()
+        print >> sys.stderr, "Profile written to {0}.txt and {0}.prof".format(
+                             base)
+        return base + ".txt", base + ".prof"
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
@@ -0,0 +1,135 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+# One GLib timeout for all of pyvolwheel's periodic work. Tasks have a
+# deadline and some slack; every task within its slack of being due when the
+# timer fires runs in that same wakeup.
+
+import os
+import heapq
+import itertools
+import collections
+import gobject
+
+def _now():
+    # Seconds on a clock that never steps, unlike time.time(): the elapsed
+    # real time from os.times() (1/100 s resolution on Linux)
+    return os.times()[4]
+
+class Task(object):
+    def __init__(self, interval, slack, func, args):
+        self.interval = interval
+        self.slack = slack
+        self.func = func
+        self.args = args
+        self.deadline = _now() + interval
+        self.active = True
+
+class Scheduler(object):
+    def __init__(self):
+        # (deadline, sequence, task)
+        self._heap = []
+        self._seq = itertools.count()
+        self._source = None
+        self._armed = None
+        # Times of the wakeups in the last minute
+        self._wakeups = collections.deque()
+
+    def add(self, interval, func, *args, **kwargs):
+        """Call func(*args) every interval seconds for as long as it returns
+        True (like gobject.timeout_add). slack is how early the task may run
+        to share a wakeup with another one, 10% of interval by default.
+        """
+        slack = kwargs.get('slack', interval * 0.1)
+        task = Task(interval, slack, func, args)
+        self._push(task)
+        self._arm()
+        return task
+
+    def remove(self, task):
+        if task is None: return
+        # Dropped from the heap lazily
+        task.active = False
+
+    def wakeups_per_minute(self):
+        cutoff = _now() - 60
+        while len(self._wakeups) > 0 and self._wakeups[0] < cutoff:
+            self._wakeups.popleft()
+        return len(self._wakeups)
+
+    def _push(self, task):
+        heapq.heappush(self._heap, (task.deadline, next(self._seq), task))
+
+    def _arm(self):
+        while len(self._heap) > 0 and self._heap[0][2].active is False:
+            heapq.heappop(self._heap)
+        if len(self._heap) == 0:
+            if self._source is not None:
+                gobject.source_remove(self._source)
+                self._source = None
+            return
+        deadline = self._heap[0][0]
+        if self._source is not None:
+            if self._armed <= deadline:
+                return
+            gobject.source_remove(self._source)
+        delay = max(0, int((deadline - _now()) * 1000))
+        self._armed = deadline
+        self._source = gobject.timeout_add(delay, self._wake)
+
+    def _wake(self):
+        self._source = None
+        now = _now()
+        self._wakeups.append(now)
+        due = []
+        rest = []
+        for entry in self._heap:
+            task = entry[2]
+            if task.active is False:
+                continue
+            elif task.deadline - task.slack <= now:
+                due.append(task)
+            else:
+                rest.append(entry)
+        heapq.heapify(rest)
+        self._heap = rest
+        try:
+            while len(due) > 0:
+                task = due.pop(0)
+                if task.active is False:
+                    continue
+                if task.func(*task.args) and task.active is True:
+                    task.deadline = now + task.interval
+                    self._push(task)
+                else:
+                    task.active = False
+        finally:
+            # If a task raised, the ones after it still get their turn
+            for task in due:
+                self._push(task)
+            self._arm()
+        return False
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
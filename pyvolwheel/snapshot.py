@@ -0,0 +1,145 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+# Snapshots of every control on a device, saved as named profiles.
+#
+# A profile is a small text file:
+#   driver<TAB>ALSA
+#   device<TAB>0
+#   <control><TAB><muted 0/1><TAB><level>,<level>,...
+#   ...
+
+import os
+import collections
+from pyvolwheel import mixer
+from pyvolwheel.config import _xdg_config_home
+
+# Default: $XDG_CONFIG_HOME/pyvolwheel-profiles
+_default_profile_dir = os.path.join(_xdg_config_home, "pyvolwheel-profiles")
+
+class Snapshot(object):
+    def __init__(self, driver, device, controls=None):
+        self.driver = driver
+        self.device = device
+        # control -> (levels, muted)
+        self.controls = collections.OrderedDict(controls or ())
+
+def capture(driver, device):
+    """Return a Snapshot of every control on the device"""
+    snap = Snapshot(driver, device)
+    for control in mixer.get_controls(driver, device):
+        try:
+            m = mixer.open_mixer(driver, device, control)
+        except mixer.MixerError:
+            continue
+        try:
+            levels = tuple(m.get_volume())
+            # Capture-only controls have no playback levels to restore
+            if len(levels) > 0:
+                snap.controls[control] = (levels, m.get_mute())
+        except mixer.MixerError:
+            pass
+        finally:
+            m.close()
+    return snap
+
+def apply(snap):
+    """Apply a Snapshot, returning the number of controls that changed
+
+    Each control is opened once and only written to if it differs from the
+    snapshot.
+    """
+    changed = 0
+    for control, (levels, muted) in snap.controls.iteritems():
+        if len(levels) == 0: continue
+        try:
+            m = mixer.open_mixer(snap.driver, snap.device, control)
+        except mixer.MixerError:
+            continue
+        try:
+            written = False
+            if tuple(m.get_volume()) != levels:
+                m.set_channels(levels)
+                written = True
+            if m.get_mute() != muted:
+                m.set_mute(muted)
+                written = True
+            if written is True:
+                changed += 1
+        finally:
+            m.close()
+    return changed
+
+def _profile_path(name, path):
+    if len(name) == 0 or '/' in name or name.startswith('.'):
+        raise ValueError("Invalid profile name '{0}'".format(name))
+    return os.path.join(path, name)
+
+def list_profiles(path=None):
+    if path is None: path = _default_profile_dir
+    if not os.path.isdir(path):
+        return []
+    return sorted(n for n in os.listdir(path) if not n.startswith('.'))
+
+def save(name, snap, path=None):
+    if path is None: path = _default_profile_dir
+    if not os.path.isdir(path):
+        os.makedirs(path, mode=0700)
+    lines = ["driver\t{0}".format(snap.driver),
+             "device\t{0}".format(snap.device)]
+    for control, (levels, muted) in snap.controls.iteritems():
+        lines.append("{0}\t{1}\t{2}".format(control, int(muted),
+                     ",".join(str(l) for l in levels)))
+    # Write to a temporary file first so a crash can't leave half a profile
+    target = _profile_path(name, path)
+    with open(target + ".tmp", 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    os.rename(target + ".tmp", target)
+
+def load(name, path=None):
+    """Return the Snapshot saved as name (IOError/ValueError on failure)"""
+    if path is None: path = _default_profile_dir
+    with open(_profile_path(name, path)) as f:
+        lines = f.read().splitlines()
+    try:
+        header = dict(l.split('\t', 1) for l in lines[:2])
+        device = header['device']
+        # Convert device to an int if possible (for ALSA card index)
+        try:
+            device = int(device)
+        except ValueError:
+            pass
+        snap = Snapshot(header['driver'], device)
+        for line in lines[2:]:
+            if len(line) == 0: continue
+            control, muted, levels = line.split('\t')
+            # Older profiles can have controls without any levels
+            levels = tuple(int(l) for l in levels.split(',') if len(l) > 0)
+            snap.controls[control] = (levels, bool(int(muted)))
+    except (KeyError, ValueError):
+        raise ValueError("Invalid profile '{0}'".format(name))
+    return snap
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
@@ -0,0 +1,305 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+# Long-running soak test for leaks.
+#
+# Runs the real Main against simulated mixers under a private Xvfb and drives
+# it through scroll, hotkey (XTest), reload, MiniMixer and preferences cycles,
+# sampling RSS, open fds, threads and live GObjects as it goes:
+#
+#   python -m pyvolwheel.soak [--cycles 1000000] [--gui]
+#
+# Exits with status 1 if any of them keeps growing, or if the hotkey listener
+# doesn't deliver the presses. Needs Xvfb and python-xlib (with the XTEST
+# extension).
+
+import os
+import gc
+import sys
+import time
+import shutil
+import tempfile
+import threading
+from optparse import OptionParser
+import gobject
+from pyvolwheel import headless
+from pyvolwheel.bench import SimMixer, start_xvfb, stop_xvfb, make_config
+from pyvolwheel.bench import make_main
+
+# What sample() returns, in order
+_metrics = ('rss', 'fds', 'threads', 'gobjects')
+
+def sample():
+    """Return this process's current (rss kB, fds, threads, GObjects)"""
+    gc.collect()
+    gobjects = len([o for o in gc.get_objects()
+                    if isinstance(o, gobject.GObject)])
+    return (headless.get_rss_kb(), len(os.listdir('/proc/self/fd')),
+            threading.active_count(), gobjects)
+
+def find_growth(samples, slack):
+    """Return the metrics that grew over the run, as (name, from, to)
+
+    The first quarter of the samples is warm-up. A metric grows if its
+    lowest value in the last quarter is above its highest in the second
+    quarter by more than its slack.
+    """
+    n = len(samples)
+    if n < 4: return []
+    early = samples[n // 4:n // 2]
+    late = samples[n - n // 4:]
+    growth = []
+    for i, name in enumerate(_metrics):
+        before = max(s[i] for s in early)
+        after = min(s[i] for s in late)
+        if after > before + slack[i]:
+            growth.append((name, before, after))
+    return growth
+
+class Driver(object):
+    """Runs soak cycles in batches from the main loop"""
+    def __init__(self, main, options, display_name):
+        from Xlib import X
+        from Xlib.display import Display
+        from Xlib.ext import xtest
+        from pyvolwheel import hotkeys
+        self.main = main
+        self.options = options
+        self.cycles = 0
+        # (cycles, rss, fds, threads, gobjects)
+        self.samples = []
+        # Hotkeys pressed through XTest, and 'key-press' emissions seen
+        self.pressed = 0
+        self.delivered = 0
+        self._hkl = None
+        self._X = X
+        self._xtest = xtest
+        self.display = Display(display_name)
+        cfg = main.config.hotkeys
+        self._keycodes = {}
+        for act in ('up', 'down'):
+            key = getattr(cfg, act)
+            keycode = self.display.keysym_to_keycode(
+                hotkeys.string_to_keysym(key))
+            if keycode == 0:
+                self.display.close()
+                raise RuntimeError("No keycode for '{0}' on the test server"
+                                   .format(key))
+            self._keycodes[act] = keycode
+
+    def _on_key_press(self, obj, key):
+        self.delivered += 1
+
+    def _watch_hkl(self):
+        # Every reload brings a new listener
+        hkl = self.main.hkl
+        if hkl is not None and hkl is not self._hkl:
+            hkl.connect('key-press', self._on_key_press)
+            self._hkl = hkl
+
+    def _press(self, act):
+        keycode = self._keycodes[act]
+        self._xtest.fake_input(self.display, self._X.KeyPress, keycode)
+        self._xtest.fake_input(self.display, self._X.KeyRelease, keycode)
+        self.pressed += 1
+
+    def _scroll(self, act):
+        if self.options.gui is False:
+            self.main.change_volume(act)
+            return
+        import gtk
+        event = gtk.gdk.Event(gtk.gdk.SCROLL)
+        if act == 'up':
+            event.direction = gtk.gdk.SCROLL_UP
+        else:
+            event.direction = gtk.gdk.SCROLL_DOWN
+        self.main.icon.emit('scroll-event', event)
+
+    def _cycle(self):
+        options = self.options
+        n = self.cycles
+        act = ('up', 'down')[n % 2]
+        self._scroll(act)
+        self._press(act)
+        if n % options.reload_every == 0:
+            self.main.reload()
+        if options.gui is True:
+            icon = self.main.icon
+            if n % options.minimixer_every == 0:
+                # Open and close it, as two clicks on the icon would
+                icon.on_activate(icon)
+                icon.on_activate(icon)
+            if n % options.prefs_every == 0:
+                icon.menu.on_prefs_click(None)
+                prefs = icon.menu.prefs
+                prefs.on_delete(prefs, None)
+        self.cycles += 1
+        if self.cycles % options.sample_every == 0:
+            self._sample()
+
+    def _sample(self):
+        s = (self.cycles,) + sample()
+        self.samples.append(s)
+        if self.options.verbose is True:
+            print >> sys.stderr, ("{0:>10} cycles  rss {1} kB  fds {2}  "
+                                  "threads {3}  gobjects {4}").format(*s)
+
+    def step(self):
+        self._watch_hkl()
+        for i in range(self.options.batch):
+            self._cycle()
+        self.display.flush()
+        if self.cycles >= self.options.cycles:
+            self.display.close()
+            self.main.ui.quit_main_loop()
+            return False
+        return True
+
+    def start(self):
+        self._sample()
+        gobject.idle_add(self.step)
+        return False
+
+def report(samples, growth, pressed, delivered):
+    lines = ["{0:>10} {1:>10} {2:>6} {3:>8} {4:>9}".format(
+             "cycles", "rss kB", "fds", "threads", "gobjects")]
+    # A handful of rows is enough to see the trend
+    rows = samples[::max(1, len(samples) // 10)]
+    if rows[-1:] != samples[-1:]:
+        rows.append(samples[-1])
+    for s in rows:
+        lines.append("{0:>10} {1:>10} {2:>6} {3:>8} {4:>9}".format(*s))
+    for name, before, after in growth:
+        lines.append("GROWTH: {0} went from {1} to {2}".format(name, before,
+                                                              after))
+    if len(growth) == 0:
+        lines.append("No growth")
+    lines.append("Hotkeys: {0} pressed, {1} delivered".format(pressed,
+                                                             delivered))
+    return "\n".join(lines)
+
+def run(options):
+    """Run the soak test
+
+    Returns (samples, growth, hotkeys pressed, hotkeys delivered), or None
+    if it couldn't start.
+    """
+    xvfb, display_name = start_xvfb()
+    tmp = tempfile.mkdtemp(prefix='pyvolwheel-soak-')
+    old_display = os.environ.get('DISPLAY')
+    try:
+        os.environ['DISPLAY'] = display_name
+        os.environ.setdefault('XDG_RUNTIME_DIR', tmp)
+        options.config = make_config(tmp, "XF86AudioRaiseVolume")
+        # A fresh device on every reload, like a real driver
+        main = make_main(options, lambda: SimMixer(log=False))
+        driver = []
+        deadline = time.time() + 30
+        def on_started():
+            # Start once the hotkey listener has its grabs
+            if main.hkl is None or not main.hkl.ready.is_set():
+                if time.time() < deadline:
+                    return True
+                print >> sys.stderr, "The hotkey listener never got ready"
+                main.ui.quit_main_loop()
+                return False
+            try:
+                driver.append(Driver(main, options, display_name))
+            except RuntimeError as e:
+                print >> sys.stderr, str(e)
+                main.ui.quit_main_loop()
+                return False
+            driver[0].start()
+            return False
+        gobject.timeout_add(10, on_started)
+        main.run()
+        if len(driver) == 0:
+            return None
+        samples = driver[0].samples
+        slack = (options.rss_slack, options.fd_slack, options.thread_slack,
+                 options.gobject_slack)
+        return (samples, find_growth([s[1:] for s in samples], slack),
+                driver[0].pressed, driver[0].delivered)
+    finally:
+        if old_display is None:
+            os.environ.pop('DISPLAY', None)
+        else:
+            os.environ['DISPLAY'] = old_display
+        stop_xvfb(xvfb)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def main(argv):
+    parser = OptionParser(usage="python -m pyvolwheel.soak [options]")
+    parser.add_option("--cycles", type="int", default=1000000,
+                      help="scroll + hotkey cycles to run [default: "
+                           "%default]")
+    parser.add_option("--batch", type="int", default=100,
+                      help="cycles per main loop iteration [default: "
+                           "%default]")
+    parser.add_option("--reload-every", type="int", default=1000, metavar="N",
+                      help="reload every N cycles [default: %default]")
+    parser.add_option("--minimixer-every", type="int", default=50,
+                      metavar="N", help="open and close the MiniMixer every "
+                                        "N cycles (--gui) [default: %default]")
+    parser.add_option("--prefs-every", type="int", default=500, metavar="N",
+                      help="open and close the preferences every N cycles "
+                           "(--gui) [default: %default]")
+    parser.add_option("--sample-every", type="int", default=10000,
+                      metavar="N", help="sample every N cycles [default: "
+                                        "%default]")
+    parser.add_option("--rss-slack", type="int", default=2048, metavar="KB",
+                      help="allowed RSS growth [default: %default]")
+    parser.add_option("--fd-slack", type="int", default=0, metavar="N",
+                      help="allowed growth in open fds [default: %default]")
+    parser.add_option("--thread-slack", type="int", default=1, metavar="N",
+                      help="allowed growth in threads [default: %default]")
+    parser.add_option("--gobject-slack", type="int", default=10,
+                      metavar="N", help="allowed growth in live GObjects "
+                                        "[default: %default]")
+    parser.add_option("--hotkey-loss", type="float", default=5, metavar="PCT",
+                      help="allowed share of hotkey presses not delivered; "
+                           "a few are lost around reloads [default: "
+                           "%default]")
+    parser.add_option("--gui", action="store_true", default=False,
+                      help="run the GTK interface instead of --headless")
+    parser.add_option("-v", "--verbose", action="store_true", default=False,
+                      help="print every sample as it's taken")
+    options = parser.parse_args(argv)[0]
+    result = run(options)
+    if result is None:
+        return 1
+    samples, growth, pressed, delivered = result
+    print report(samples, growth, pressed, delivered)
+    if len(growth) > 0:
+        return 1
+    if delivered < pressed * (1 - options.hotkey_loss / 100.0):
+        print >> sys.stderr, "The hotkey listener lost too many presses"
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
@@ -0,0 +1,266 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+# Publishes volume/mute/control changes as JSON lines on a Unix socket, so
+# status bars can follow pyvolwheel instead of polling the mixer themselves:
+#
+#   $ socat - UNIX-CONNECT:$XDG_RUNTIME_DIR/pyvolwheel/status.sock
+#   {"event": "state", "control": "Master", "level": 74, "muted": false}
+#   {"event": "volume", "control": "Master", "level": 77, "muted": false}
+#
+# Every subscriber gets the current state when it connects, then one line per
+# change. A subscriber that falls more than its buffer behind is dropped.
+
+import os
+import json
+import mmap
+import stat
+import errno
+import socket
+import gobject
+from pyvolwheel import statuspage
+from pyvolwheel.config import get_runtime_dir
+
+class _Subscriber(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.buf = ''
+        self.in_watch = None
+        self.out_watch = None
+
+class StatusPublisher(object):
+    def __init__(self, path=None, limit=64 * 1024):
+        if path is None:
+            path = os.path.join(get_runtime_dir(), "status.sock")
+        self.path = path
+        # Most bytes a subscriber may have waiting before it's dropped
+        self.limit = limit
+        self._sock = None
+        self._watch = None
+        self._subs = []
+        self._state = None
+
+    def start(self):
+        """Start listening; returns False if another instance already is"""
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                # Stale socket from an instance that didn't clean up
+                os.unlink(self.path)
+            else:
+                return False
+            finally:
+                probe.close()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        self._sock.listen(8)
+        self._sock.setblocking(False)
+        self._watch = gobject.io_add_watch(self._sock, gobject.IO_IN,
+                                           self._on_accept)
+        return True
+
+    def _encode(self, event, state):
+        control, level, muted, error = state
+        msg = {'event': event, 'control': control, 'level': level,
+               'muted': muted}
+        if error is not None:
+            msg['error'] = error
+        return json.dumps(msg, sort_keys=True) + "\n"
+
+    def publish(self, control, level, muted):
+        self._publish((control, level, muted, None))
+
+    def publish_error(self, error):
+        self._publish((None, None, None, error))
+
+    def _publish(self, state):
+        old = self._state
+        if state == old:
+            return
+        self._state = state
+        if state[3] is not None:
+            event = 'error'
+        elif old is None or old[0] != state[0]:
+            event = 'control'
+        elif old[2] != state[2]:
+            event = 'mute'
+        else:
+            event = 'volume'
+        line = self._encode(event, state)
+        for sub in list(self._subs):
+            self._send(sub, line)
+
+    def _on_accept(self, source, condition):
+        try:
+            sock = self._sock.accept()[0]
+        except socket.error:
+            return True
+        sock.setblocking(False)
+        sub = _Subscriber(sock)
+        self._subs.append(sub)
+        # Subscribers have nothing to say; this is how we notice them leave
+        sub.in_watch = gobject.io_add_watch(sock, gobject.IO_IN |
+                                            gobject.IO_HUP | gobject.IO_ERR,
+                                            self._on_input, sub)
+        if self._state is not None:
+            self._send(sub, self._encode('state', self._state))
+        return True
+
+    def _on_input(self, source, condition, sub):
+        try:
+            data = sub.sock.recv(4096)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                return True
+            data = ''
+        if len(data) == 0:
+            sub.in_watch = None
+            self._drop(sub)
+            return False
+        return True
+
+    def _send(self, sub, data):
+        if len(sub.buf) + len(data) > self.limit:
+            # Too slow to keep up; don't let it hold anything up
+            self._drop(sub)
+            return
+        sub.buf += data
+        self._flush(sub)
+
+    def _flush(self, sub):
+        try:
+            sent = sub.sock.send(sub.buf)
+        except socket.error as e:
+            if e.args[0] not in (errno.EAGAIN, errno.EINTR):
+                self._drop(sub)
+                return
+            sent = 0
+        sub.buf = sub.buf[sent:]
+        if len(sub.buf) > 0 and sub.out_watch is None:
+            sub.out_watch = gobject.io_add_watch(sub.sock, gobject.IO_OUT,
+                                                 self._on_writable, sub)
+
+    def _on_writable(self, source, condition, sub):
+        sub.out_watch = None
+        if sub in self._subs:
+            self._flush(sub)
+        return False
+
+    def _drop(self, sub):
+        if sub not in self._subs: return
+        self._subs.remove(sub)
+        for watch in (sub.in_watch, sub.out_watch):
+            if watch is not None:
+                gobject.source_remove(watch)
+        sub.in_watch = sub.out_watch = None
+        sub.sock.close()
+
+    def close(self):
+        for sub in list(self._subs):
+            self._drop(sub)
+        if self._sock is not None:
+            gobject.source_remove(self._watch)
+            self._sock.close()
+            self._sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+def _open_private(path):
+    # Opens (creating if needed) a file only we can have put there: never
+    # through a symlink, and never someone else's file linked in
+    flags = os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW
+    try:
+        fd = os.open(path, flags, 0600)
+    except OSError as e:
+        if e.errno != errno.ELOOP: raise
+        # A symlink; replace it with a file of our own
+        os.unlink(path)
+        fd = os.open(path, flags | os.O_EXCL, 0600)
+    st = os.fstat(fd)
+    if (not stat.S_ISREG(st.st_mode) or st.st_uid != os.getuid() or
+        st.st_nlink != 1):
+        os.close(fd)
+        raise OSError(errno.EPERM, "Not a private file of ours", path)
+    return fd
+
+class StatusPageWriter(object):
+    """Keeps the memory mapped status page (see pyvolwheel.statuspage)
+    up to date, seqlock style"""
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(get_runtime_dir(), "status.page")
+        self.path = path
+        fd = _open_private(path)
+        try:
+            os.ftruncate(fd, statuspage.SIZE)
+            self._map = mmap.mmap(fd, statuspage.SIZE, mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        seq = statuspage.SEQ.unpack_from(self._map,
+                                         statuspage.SEQ_OFFSET)[0]
+        # Carry on from an earlier instance's sequence so readers see a change
+        self._seq = seq + (seq & 1)
+        statuspage.HEADER.pack_into(self._map, 0, statuspage.MAGIC,
+                                    statuspage.VERSION)
+        self._last = None
+        self._levels = ()
+
+    def _write(self, flags, levels, control):
+        body = (flags, len(levels)) + tuple(levels) + \
+               (0,) * (statuspage.MAX_CHANNELS - len(levels)) + (control,)
+        if body == self._last:
+            return
+        self._last = body
+        # Odd while writing, even once the page is consistent again
+        self._seq = (self._seq + 1) & 0xffffffff
+        statuspage.SEQ.pack_into(self._map, statuspage.SEQ_OFFSET, self._seq)
+        statuspage.BODY.pack_into(self._map, statuspage.BODY_OFFSET, *body)
+        self._seq = (self._seq + 1) & 0xffffffff
+        statuspage.SEQ.pack_into(self._map, statuspage.SEQ_OFFSET, self._seq)
+
+    def update(self, control, levels, muted):
+        levels = tuple(levels)[:statuspage.MAX_CHANNELS]
+        self._levels = levels
+        flags = statuspage.FLAG_MUTED if muted else 0
+        self._write(flags, levels, control[:32])
+
+    def set_error(self):
+        control = self._last[-1] if self._last is not None else ''
+        self._write(statuspage.FLAG_ERROR, self._levels, control)
+
+    def close(self):
+        if self._map is None: return
+        last = self._last or (0, 0) + (0,) * statuspage.MAX_CHANNELS + ('',)
+        self._write(last[0] | statuspage.FLAG_STOPPED,
+                    last[2:2 + last[1]], last[-1])
+        self._map.close()
+        self._map = None
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
@@ -0,0 +1,113 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+# Reader for the status page pyvolwheel keeps in
+# $XDG_RUNTIME_DIR/pyvolwheel/status.page. Once the page is mapped, reading
+# it is a few memory loads and no system calls:
+#
+#   >>> page = StatusPage()
+#   >>> page.read()
+#   Status(seq=42, control='Master', levels=(74, 74), muted=False, ...)
+#
+# Layout (64 bytes, little endian):
+#   0   char[4]   magic "PVWS"
+#   4   uint32    layout version
+#   8   uint32    sequence number; odd while the page is being written
+#   12  uint8     flags (see FLAG_*)
+#   13  uint8     number of channels
+#   14  pad[2]
+#   16  int16[8]  level of each channel (percent)
+#   32  char[32]  control name, NUL padded
+#
+# A read is consistent if the sequence number was even and the same before
+# and after copying the rest of the page.
+
+import os
+import mmap
+import struct
+from collections import namedtuple
+from pyvolwheel.config import get_runtime_dir
+
+MAGIC = 'PVWS'
+VERSION = 1
+SIZE = 64
+MAX_CHANNELS = 8
+
+FLAG_MUTED = 1 << 0
+FLAG_ERROR = 1 << 1
+# pyvolwheel has quit; the rest of the page is the last state it saw
+FLAG_STOPPED = 1 << 2
+
+HEADER = struct.Struct('<4sI')
+SEQ = struct.Struct('<I')
+SEQ_OFFSET = 8
+BODY = struct.Struct('<BBxx8h32s')
+BODY_OFFSET = 12
+
+Status = namedtuple('Status', 'seq control levels muted error stopped')
+
+def default_path():
+    return os.path.join(get_runtime_dir(create=False), "status.page")
+
+def decode(seq, body):
+    flags, channels, rest = body[0], body[1], body[2:]
+    levels, control = rest[:MAX_CHANNELS], rest[MAX_CHANNELS]
+    return Status(seq, control.rstrip('\0'), tuple(levels[:channels]),
+                  bool(flags & FLAG_MUTED), bool(flags & FLAG_ERROR),
+                  bool(flags & FLAG_STOPPED))
+
+class StatusPage(object):
+    def __init__(self, path=None):
+        if path is None: path = default_path()
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), SIZE, mmap.MAP_SHARED,
+                                  mmap.PROT_READ)
+        magic, version = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("Not a pyvolwheel status page: '{0}'".format(
+                             path))
+
+    def seq(self):
+        """The sequence number; it changes whenever the status does"""
+        return SEQ.unpack_from(self._map, SEQ_OFFSET)[0]
+
+    def read(self, retries=1000):
+        """Return the current Status (None if pyvolwheel kept writing)"""
+        for _ in xrange(retries):
+            seq = SEQ.unpack_from(self._map, SEQ_OFFSET)[0]
+            if seq & 1:
+                continue
+            body = BODY.unpack_from(self._map, BODY_OFFSET)
+            if SEQ.unpack_from(self._map, SEQ_OFFSET)[0] == seq:
+                return decode(seq, body)
+        return None
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
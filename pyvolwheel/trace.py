@@ -0,0 +1,234 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+# Recording and replaying of mixer operation traces.
+#
+# A trace is a short header followed by fixed size records:
+#   double  time since the start of the trace (seconds)
+#   float   duration of the call (seconds)
+#   uchar   operation (see _ops)
+#   uchar   status (0 = ok, 1 = MixerError)
+#   short   argument (volume, delta, mute flag or hotkey)
+#   short   result of the first channel (-1 if none)
+#   short   result of the second channel (-1 if none)
+
+import sys
+import time
+import struct
+import threading
+from collections import namedtuple
+from pyvolwheel import mixer
+
+_MAGIC = 'PVWT\x01'
+_RECORD = struct.Struct('<dfBBhhh')
+
+_ops = ('get_volume', 'set_volume', 'change_volume', 'get_mute', 'set_mute',
+        'key')
+_keys = ('up', 'down', 'mute')
+_OP_KEY = _ops.index('key')
+
+TraceEvent = namedtuple('TraceEvent', 'time duration op status arg result')
+
+class Recorder(object):
+    """Writes a trace of every operation on the mixers it wraps"""
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(_MAGIC)
+        self._start = time.time()
+        # Mixer calls and hotkeys are recorded from different threads
+        self._lock = threading.Lock()
+
+    def _record(self, op, arg, result, status, start, end):
+        if self._file is None: return
+        if isinstance(result, (list, tuple)):
+            r = (list(result) + [-1, -1])[:2]
+        elif result is None:
+            r = [-1, -1]
+        else:
+            r = [int(result), -1]
+        rec = _RECORD.pack(start - self._start, end - start, _ops.index(op),
+                           status, int(arg), r[0], r[1])
+        with self._lock:
+            if self._file is not None:
+                self._file.write(rec)
+
+    def wrap(self, mixer_):
+        """Return a proxy for mixer_ that records every call"""
+        return RecordingMixer(self, mixer_)
+
+    def watch(self, listener):
+        """Record the 'key-press' signals of a hotkey listener"""
+        def on_key(obj, key):
+            if key not in _keys: return False
+            now = time.time()
+            self._record('key', _keys.index(key), None, 0, now, now)
+            return False
+        listener.connect('key-press', on_key)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class RecordingMixer(object):
+    def __init__(self, recorder, mixer_):
+        self._recorder = recorder
+        self._mixer = mixer_
+
+    def __getattr__(self, name):
+        return getattr(self._mixer, name)
+
+    def _call(self, op, arg, *args):
+        start = time.time()
+        try:
+            result = getattr(self._mixer, op)(*args)
+        except mixer.MixerError:
+            self._recorder._record(op, arg, None, 1, start, time.time())
+            raise
+        self._recorder._record(op, arg, result, 0, start, time.time())
+        return result
+
+    def get_volume(self):
+        return self._call('get_volume', 0)
+
+    def set_volume(self, volume):
+        return self._call('set_volume', volume, volume)
+
+    def change_volume(self, delta):
+        return self._call('change_volume', delta, delta)
+
+    def get_mute(self):
+        return self._call('get_mute', 0)
+
+    def set_mute(self, flag):
+        return self._call('set_mute', flag, flag)
+
+def load(path):
+    """Return the list of TraceEvents in a trace file"""
+    with open(path, 'rb') as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("Not a pyvolwheel trace: '{0}'".format(path))
+        data = f.read()
+    events = []
+    for off in range(0, len(data) - len(data) % _RECORD.size, _RECORD.size):
+        t, dur, op, status, arg, r0, r1 = _RECORD.unpack_from(data, off)
+        result = tuple(r for r in (r0, r1) if r != -1)
+        events.append(TraceEvent(t, dur, _ops[op], status, arg, result))
+    return events
+
+class ReplayStats(object):
+    def __init__(self):
+        # op -> list of call durations
+        self.durations = {}
+        self.errors = 0
+        self.keys = 0
+
+    def add(self, op, duration):
+        self.durations.setdefault(op, []).append(duration)
+
+    def calls(self):
+        return sum(len(d) for d in self.durations.itervalues())
+
+    def summary(self):
+        lines = ["{0} device calls, {1} errors, {2} hotkey presses".format(
+                 self.calls(), self.errors, self.keys)]
+        for op in _ops:
+            d = sorted(self.durations.get(op, []))
+            if len(d) == 0: continue
+            lines.append("  {0:<14} n={1:<6} mean={2:.3f}ms p50={3:.3f}ms "
+                         "p95={4:.3f}ms max={5:.3f}ms".format(op, len(d),
+                         1000 * sum(d) / len(d), 1000 * d[len(d) // 2],
+                         1000 * d[int(len(d) * 0.95)], 1000 * d[-1]))
+        return "\n".join(lines)
+
+def recorded_stats(events):
+    """ReplayStats for the calls as they happened when recorded"""
+    stats = ReplayStats()
+    for ev in events:
+        if ev.op == 'key':
+            stats.keys += 1
+            continue
+        stats.add(ev.op, ev.duration)
+        if ev.status != 0:
+            stats.errors += 1
+    return stats
+
+def replay(events, target, realtime=True):
+    """Replay events against the mixer target and return its ReplayStats
+
+    With realtime set the original spacing of the calls is kept, otherwise
+    they're issued as fast as possible.
+    """
+    stats = ReplayStats()
+    start = time.time()
+    for ev in events:
+        if realtime:
+            delay = start + ev.time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        if ev.op == 'key':
+            # The operations the key press caused are in the trace already
+            stats.keys += 1
+            continue
+        args = ()
+        if ev.op in ('set_volume', 'change_volume'):
+            args = (ev.arg,)
+        elif ev.op == 'set_mute':
+            args = (bool(ev.arg),)
+        t = time.time()
+        try:
+            getattr(target, ev.op)(*args)
+        except mixer.MixerError:
+            stats.errors += 1
+        stats.add(ev.op, time.time() - t)
+    return stats
+
+def main(argv):
+    usage = ("Usage: python -m pyvolwheel.trace TRACE DRIVER DEVICE CONTROL "
+             "[--fast]")
+    args = [a for a in argv if a != '--fast']
+    if len(args) != 4:
+        print usage
+        return 2
+    path, driver, device, control = args
+    try:
+        device = int(device)
+    except ValueError:
+        pass
+    events = load(path)
+    target = mixer.open_mixer(driver, device, control)
+    print "Recorded:"
+    print recorded_stats(events).summary()
+    stats = replay(events, target, '--fast' not in argv)
+    print "Replayed on {0}:".format(driver)
+    print stats.summary()
+    target.close()
+    mixer.release_handles()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
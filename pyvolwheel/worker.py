@@ -0,0 +1,164 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+import time
+import threading
+import gobject
+from pyvolwheel import mixer
+
+class MixerWorker(threading.Thread):
+    """Owns a mixer and runs every call on it away from the main loop
+
+    Requests are queued and merged with any pending request they supersede
+    (two volume changes become one, a second mute toggle cancels the first).
+    After each batch the control's state is read back and handed to
+    callback(state, error) on the main loop, where state is a
+    (control, level, muted, levels) tuple (levels has every channel) or None
+    if error is set.
+    """
+    def __init__(self, mixer_, callback, timeout=1.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.mixer = mixer_
+        self.timeout = timeout
+        self._callback = callback
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._running = True
+        self._call_start = None
+        # Whether the main loop has been sent the state at least once
+        self._reported = False
+
+    def _submit(self, key, merge):
+        with self._cond:
+            value = merge(self._pending.get(key))
+            if value is None:
+                self._pending.pop(key, None)
+            else:
+                self._pending[key] = value
+            # Always read the state back after a request
+            self._pending['refresh'] = True
+            self._cond.notify()
+
+    def set_volume(self, volume):
+        self._submit('volume', lambda old: ('set', volume))
+
+    def change_volume(self, delta):
+        def merge(old):
+            if old is None:
+                return ('change', delta)
+            elif old[0] == 'set':
+                return ('set', mixer._clamp(old[1] + delta))
+            return ('change', old[1] + delta)
+        self._submit('volume', merge)
+
+    def set_mute(self, flag):
+        self._submit('mute', lambda old: flag)
+
+    def toggle_mute(self):
+        def merge(old):
+            if old is None:
+                return 'toggle'
+            elif old == 'toggle':
+                # Toggling twice is a no-op
+                return None
+            return not old
+        self._submit('mute', merge)
+
+    def refresh(self):
+        self._submit('refresh', lambda old: True)
+
+    def call(self, func, callback=None):
+        """Run func() on the worker, then callback(result) on the main loop"""
+        self._submit('calls', lambda old: (old or []) + [(func, callback)])
+
+    @property
+    def hung(self):
+        """True if the device has been stuck in one call for too long"""
+        start = self._call_start
+        return start is not None and time.time() - start > self.timeout
+
+    def _call(self, func, *args):
+        self._call_start = time.time()
+        try:
+            return func(*args)
+        finally:
+            self._call_start = None
+
+    def _process(self, pending):
+        m = self.mixer
+        # A plain refresh of a device that can tell us nothing changed
+        # (see Mixer.changed()) costs one cheap call and no report
+        if (pending.keys() == ['refresh'] and self._reported is True and
+            self._call(m.changed) is False):
+            return None
+        volume = pending.get('volume')
+        if volume is not None:
+            if volume[0] == 'set':
+                self._call(m.set_volume, volume[1])
+            else:
+                self._call(m.change_volume, volume[1])
+        mute = pending.get('mute')
+        if mute == 'toggle':
+            self._call(m.set_mute, not self._call(m.get_mute))
+        elif mute is not None:
+            self._call(m.set_mute, mute)
+        for func, callback in pending.get('calls', ()):
+            result = self._call(func)
+            if callback is not None:
+                gobject.idle_add(callback, result)
+        levels = tuple(self._call(m.get_volume))
+        return (m.get_control(), levels[0], self._call(m.get_mute), levels)
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._running is True and len(self._pending) == 0:
+                    self._cond.wait()
+                if self._running is False:
+                    break
+                pending, self._pending = self._pending, {}
+            try:
+                state, error = self._process(pending), None
+            except mixer.MixerError as e:
+                state, error = None, str(e)
+            except Exception as e:
+                # Anything else (a driver error that slipped through, a
+                # control without playback channels, a failing call())
+                # must not end the thread and leave every request queued
+                state, error = None, "{0}: {1}".format(type(e).__name__,
+                                                       str(e))
+            if state is None and error is None:
+                continue
+            # Report again after an error, even if nothing changed
+            self._reported = error is None
+            gobject.idle_add(self._callback, state, error)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
@@ -0,0 +1,85 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+# Enforces the headless memory and startup targets: starts a real
+# 'pyvolwheel --headless --check-budget' (no profiler) on this machine's
+# mixer and fails if it reports a miss.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _root)
+
+try:
+    import gobject
+except ImportError:
+    gobject = None
+from pyvolwheel import mixer
+
+def _have_mixer():
+    # Drivers can be importable without any device to go with them
+    for driver in mixer.get_drivers():
+        try:
+            device = mixer.get_devices(driver)[0]
+            mixer.get_controls(driver, device)
+        except (mixer.MixerError, EnvironmentError):
+            continue
+        return True
+    return False
+
+class HeadlessBudgetTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='pyvolwheel-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    @unittest.skipIf(gobject is None, "needs pygobject")
+    @unittest.skipIf(not _have_mixer(), "needs a mixer device")
+    def test_within_budget(self):
+        path = [_root] + os.environ.get('PYTHONPATH', '').split(os.pathsep)
+        env = dict(os.environ, XDG_CONFIG_HOME=self.tmp,
+                   XDG_RUNTIME_DIR=self.tmp,
+                   PYTHONPATH=os.pathsep.join(p for p in path if p))
+        # No $DISPLAY: a headless start must not need one
+        env.pop('DISPLAY', None)
+        proc = subprocess.Popen([sys.executable,
+                                 os.path.join(_root, 'bin', 'pyvolwheel'),
+                                 '--headless', '--check-budget',
+                                 '--config', os.path.join(self.tmp, 'config')],
+                                env=env, stderr=subprocess.PIPE)
+        err = proc.communicate()[1]
+        self.assertEqual(proc.returncode, 0, err)
+        self.assertIn("within budget", err)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
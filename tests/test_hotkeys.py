@@ -0,0 +1,209 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+
+# Hotkey parsing, and the evdev hotkey listener, fed input_event structs
+# through a FIFO standing in for a /dev/input/event* device.
+
+import os
+import sys
+import time
+import errno
+import shutil
+import struct
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import gobject
+except ImportError:
+    gobject = None
+else:
+    from pyvolwheel import hotkeys, config
+
+_PRESS, _RELEASE, _REPEAT = 1, 0, 2
+
+def event(code, value):
+    # struct input_event with a zero timestamp
+    return struct.pack('llHHi', 0, 0, 0x01, code, value)
+
+@unittest.skipIf(gobject is None or not hotkeys.available,
+                 "needs pygobject and python-xlib")
+class ParseAccelTest(unittest.TestCase):
+    def test_default_binds(self):
+        tmp = tempfile.mkdtemp(prefix='pyvolwheel-test-')
+        try:
+            cfg = config.Config(os.path.join(tmp, 'none'))
+        finally:
+            shutil.rmtree(tmp)
+        for act in ('up', 'down', 'mute'):
+            key = getattr(cfg.hotkeys, act)
+            keysym, mods = hotkeys.parse_accel(key)
+            self.assertNotEqual(keysym, 0, key)
+            self.assertEqual(mods, frozenset())
+
+    def test_modifiers(self):
+        self.assertEqual(hotkeys.parse_accel('<Ctl><Shft>Up')[1],
+                         frozenset(['control', 'shift']))
+        self.assertEqual(hotkeys.parse_accel('<Release><Mod4>F1')[1],
+                         frozenset(['release', 'mod4']))
+        self.assertIsNone(hotkeys.parse_accel('<Bogus>Up'))
+        self.assertIsNone(hotkeys.parse_accel('NoSuchKey'))
+
+@unittest.skipIf(gobject is None or not hotkeys.available,
+                 "needs pygobject and python-xlib")
+class HotKeyListenerTest(unittest.TestCase):
+    def test_no_display(self):
+        from Xlib.error import DisplayError
+        fds = len(os.listdir('/proc/self/fd'))
+        # No X server listens on this one
+        self.assertRaises(DisplayError, hotkeys.HotKeyListener,
+                          {'up': 'Up'}, ':4093')
+        self.assertEqual(len(os.listdir('/proc/self/fd')), fds)
+
+@unittest.skipIf(gobject is None, "needs pygobject")
+class ParseEvdevKeyTest(unittest.TestCase):
+    def test_keys(self):
+        self.assertEqual(hotkeys.parse_evdev_key('<Super>1'),
+                         (2, frozenset(['super'])))
+        self.assertEqual(hotkeys.parse_evdev_key('0'), (11, frozenset()))
+        self.assertEqual(hotkeys.parse_evdev_key('XF86AudioMicMute'),
+                         (248, frozenset()))
+        self.assertEqual(hotkeys.parse_evdev_key('KP_Add'), (78, frozenset()))
+        self.assertEqual(hotkeys.parse_evdev_key('<Mod1>KP_0'),
+                         (82, frozenset(['alt'])))
+
+    def test_unusable(self):
+        self.assertIsNone(hotkeys.parse_evdev_key('<Hyper>Up'))
+        self.assertIsNone(hotkeys.parse_evdev_key('<Bogus>Up'))
+        self.assertIsNone(hotkeys.parse_evdev_key('NoSuchKey'))
+
+@unittest.skipIf(gobject is None, "needs pygobject")
+class EvdevNoDevicesTest(unittest.TestCase):
+    def test_no_devices(self):
+        fds = len(os.listdir('/proc/self/fd'))
+        for devices in ([], ['/nonexistent/event0']):
+            try:
+                hotkeys.EvdevHotKeyListener({'up': 'Up'}, devices)
+            except OSError as e:
+                self.assertEqual(e.errno, errno.ENOENT)
+            else:
+                self.fail("no OSError")
+        self.assertEqual(len(os.listdir('/proc/self/fd')), fds)
+
+@unittest.skipIf(gobject is None, "needs pygobject")
+class EvdevHotKeyListenerTest(unittest.TestCase):
+    def setUp(self):
+        gobject.threads_init()
+        self.tmp = tempfile.mkdtemp(prefix='pyvolwheel-test-')
+        self.fifo = os.path.join(self.tmp, 'event0')
+        os.mkfifo(self.fifo)
+        binds = {'up': '<Control>Up',
+                 'down': 'XF86AudioLowerVolume',
+                 'mute': 'XF86AudioMute',
+                 'play': '<Release>XF86AudioPlay'}
+        # Opens the FIFO for reading, so opening the writer doesn't block
+        self.hkl = hotkeys.EvdevHotKeyListener(binds, devices=[self.fifo])
+        self.writer = os.open(self.fifo, os.O_WRONLY)
+        self.pressed = []
+        self.hkl.connect('key-press', self.on_key_press)
+
+    def on_key_press(self, obj, key):
+        self.pressed.append(key)
+
+    def tearDown(self):
+        if self.writer is not None:
+            os.close(self.writer)
+        self.hkl.stop()
+        self.hkl.join(1)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def write(self, *events):
+        os.write(self.writer, ''.join(events))
+
+    def run_until_eof(self, timeout=5):
+        # Closing the writer is EOF, after which the listener has no devices
+        # left and ends; keep the main loop going until its signals are in
+        os.close(self.writer)
+        self.writer = None
+        loop = gobject.MainLoop()
+        deadline = time.time() + timeout
+        def check():
+            if not self.hkl.is_alive() or time.time() > deadline:
+                # Queued behind the listener's own idle callbacks
+                gobject.idle_add(loop.quit)
+                return False
+            return True
+        gobject.timeout_add(10, check)
+        loop.run()
+        self.assertFalse(self.hkl.is_alive())
+
+    def test_modifiers(self):
+        self.hkl.start()
+        # Up alone isn't bound; Control+Up is
+        self.write(event(103, _PRESS), event(103, _RELEASE),
+                   event(29, _PRESS), event(103, _PRESS),
+                   event(103, _RELEASE), event(29, _RELEASE),
+                   event(103, _PRESS), event(103, _RELEASE))
+        self.run_until_eof()
+        self.assertEqual(self.pressed, ['up'])
+
+    def test_repeat(self):
+        self.hkl.start()
+        self.write(event(113, _PRESS), event(113, _REPEAT),
+                   event(113, _REPEAT), event(113, _RELEASE))
+        self.run_until_eof()
+        self.assertEqual(self.pressed, ['mute'] * 3)
+
+    def test_release(self):
+        self.hkl.start()
+        self.write(event(164, _PRESS), event(164, _REPEAT),
+                   event(164, _RELEASE))
+        self.run_until_eof()
+        self.assertEqual(self.pressed, ['play'])
+
+    def test_partial_read(self):
+        self.hkl.start()
+        data = event(114, _PRESS) + event(114, _RELEASE)
+        # Split in the middle of the first event
+        os.write(self.writer, data[:10])
+        time.sleep(0.1)
+        os.write(self.writer, data[10:])
+        self.run_until_eof()
+        self.assertEqual(self.pressed, ['down'])
+
+    def test_eof(self):
+        self.hkl.start()
+        # A truncated event before EOF is dropped, not misread
+        self.write(event(113, _PRESS), event(113, _PRESS)[:5])
+        self.run_until_eof()
+        self.assertEqual(self.pressed, ['mute'])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79
@@ -0,0 +1,262 @@
+#
+# pyvolwheel
+# Copyright (C) 2010 epinull <epinull at gmail dot com>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+#
+
+
+
+# OSSMixer's modify_counter caching and the mixer handle pool, against a
+# stand-in mixer device and a mock SOUND_MIXER_INFO ioctl, and ALSAMixer's
+# volume steps against a stand-in control with a dB scale.
+
+import os
+import sys
+import fcntl
+import struct
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyvolwheel import mixer
+
+class FakeOSSDevice(object):
+    """Stands in for ossaudiodev's mixer object"""
+    def __init__(self):
+        self.levels = (50, 50)
+        self.counter = 0
+        self.reads = 0
+        self.info_supported = True
+
+    def fileno(self):
+        return -1
+
+    def controls(self):
+        # Only the first control ('Vol')
+        return 1
+
+    def get(self, control):
+        self.reads += 1
+        return self.levels
+
+    def set(self, control, levels):
+        self.levels = levels
+        self.counter += 1
+
+    def close(self):
+        pass
+
+    def ioctl(self, fd, request, arg):
+        if self.info_supported is False:
+            raise IOError(25, "Inappropriate ioctl for device")
+        info = bytearray(arg)
+        struct.pack_into('i', info, mixer._MIXER_INFO_COUNTER, self.counter)
+        return str(info)
+
+class FakeOSSTest(unittest.TestCase):
+    """Opening an OSS mixer gets a FakeOSSDevice"""
+    def setUp(self):
+        import ossaudiodev
+        self.device = FakeOSSDevice()
+        self._patched = [(ossaudiodev, 'openmixer', ossaudiodev.openmixer),
+                         (fcntl, 'ioctl', fcntl.ioctl)]
+        ossaudiodev.openmixer = lambda device: self.device
+        fcntl.ioctl = lambda fd, request, arg: self.device.ioctl(fd, request,
+                                                                 arg)
+
+    def tearDown(self):
+        for module, name, value in self._patched:
+            setattr(module, name, value)
+
+@unittest.skipIf('OSS' not in mixer.get_drivers(), "needs ossaudiodev")
+class OSSModifyCounterTest(FakeOSSTest):
+    def open(self):
+        return mixer.OSSMixer('/dev/mixer', 'Vol')
+
+    def test_skips_reads_while_unchanged(self):
+        m = self.open()
+        self.assertEqual(m.get_volume(), (50, 50))
+        self.assertEqual(m.get_volume(), (50, 50))
+        self.assertEqual(self.device.reads, 1)
+
+    def test_reads_after_outside_change(self):
+        m = self.open()
+        m.get_volume()
+        # Someone else sets the level
+        self.device.levels = (20, 30)
+        self.device.counter += 1
+        self.assertEqual(m.get_volume(), (20, 30))
+        self.assertEqual(self.device.reads, 2)
+
+    def test_reads_after_own_write(self):
+        m = self.open()
+        m.get_volume()
+        m.set_volume(70)
+        self.assertEqual(m.get_volume(), (70, 70))
+        self.assertEqual(self.device.reads, 2)
+        m.get_volume()
+        self.assertEqual(self.device.reads, 2)
+
+    def test_changed(self):
+        m = self.open()
+        self.assertTrue(m.changed())
+        self.assertFalse(m.changed())
+        self.device.counter += 1
+        self.assertTrue(m.changed())
+        self.assertFalse(m.changed())
+
+    def test_without_mixer_info(self):
+        self.device.info_supported = False
+        m = self.open()
+        self.assertTrue(m.changed())
+        m.get_volume()
+        m.get_volume()
+        self.assertEqual(self.device.reads, 2)
+
+@unittest.skipIf('OSS' not in mixer.get_drivers(), "needs ossaudiodev")
+class MixerPoolTest(FakeOSSTest):
+    def setUp(self):
+        FakeOSSTest.setUp(self)
+        import ossaudiodev
+        # A new device for every open, to tell handles apart
+        def openmixer(device):
+            self.device = FakeOSSDevice()
+            return self.device
+        ossaudiodev.openmixer = openmixer
+        self.pool = mixer.MixerPool()
+
+    def acquire(self):
+        return self.pool.acquire('OSS', '/dev/mixer', 'Vol')
+
+    def test_shared_while_busy(self):
+        m = self.acquire()
+        self.assertIs(self.acquire(), m)
+
+    def test_close_twice(self):
+        m = self.acquire()
+        m.close()
+        m.close()
+        # Still open in the pool, and handed out again
+        self.assertIs(self.acquire(), m)
+        self.assertEqual(m.get_volume(), (50, 50))
+
+    def test_forget(self):
+        m = self.acquire()
+        m.abandon()
+        fresh = self.acquire()
+        self.assertIsNot(fresh, m)
+        # The abandoned handle is still usable by whoever has it
+        self.assertEqual(m.get_volume(), (50, 50))
+        fresh.close()
+        self.assertIs(self.acquire(), fresh)
+
+class FakeALSAControl(object):
+    """Stands in for alsaaudio's Mixer: a TLV DB_SCALE control"""
+    # Raw 0-87, -65.25 dB and 0.75 dB per step
+    rmax = 87
+    db_min = -6525
+    db_step = 75
+    # The lowest step mutes (SND_CTL_TLV_DB_GAIN_MUTE)
+    mute_floor = False
+
+    def __init__(self, control, cardindex=0):
+        self.raw = [50, 50]
+
+    def _db(self, raw):
+        if self.mute_floor is True and raw == 0:
+            return -9999999
+        return self.db_min + raw * self.db_step
+
+    def getrange(self, units=None):
+        import alsaaudio
+        if units == alsaaudio.VOLUME_UNITS_RAW:
+            return 0, self.rmax
+        return self._db(0), self._db(self.rmax)
+
+    def getvolume(self, units=None):
+        import alsaaudio
+        if units == alsaaudio.VOLUME_UNITS_RAW:
+            return list(self.raw)
+        return [self._db(r) for r in self.raw]
+
+    def setvolume(self, volume, channel=None, units=None):
+        import alsaaudio
+        if units == alsaaudio.VOLUME_UNITS_DB:
+            # Nearest raw step, as snd_mixer_selem_set_playback_dB does
+            volume = int(round((volume - self.db_min) /
+                               float(self.db_step)))
+            volume = max(0, min(self.rmax, volume))
+        self.raw = [volume, volume]
+
+    def close(self):
+        pass
+
+@unittest.skipIf(not mixer.alsa_exact_steps, "needs pyalsaaudio >= 0.9")
+class ALSAStepTest(unittest.TestCase):
+    def setUp(self):
+        import alsaaudio
+        self._mixer = alsaaudio.Mixer
+        alsaaudio.Mixer = FakeALSAControl
+
+    def tearDown(self):
+        import alsaaudio
+        alsaaudio.Mixer = self._mixer
+        FakeALSAControl.mute_floor = False
+
+    def steps(self, m, delta):
+        # Step until the end of the range, returning every raw value
+        raws = []
+        end = 100 if delta > 0 else 0
+        while m.get_volume()[0] != end:
+            m.change_volume(delta)
+            raws.append(m._mixer.raw[0])
+            self.assertLess(len(raws), 101)
+        return raws
+
+    def check_steps(self):
+        m = mixer.ALSAMixer(0, 'Master')
+        m.set_volume(0)
+        up = self.steps(m, 1)
+        # Every step moves, and the last one reaches the top
+        self.assertEqual(up, sorted(set(up)))
+        self.assertEqual(up[-1], FakeALSAControl.rmax)
+        down = self.steps(m, -1)
+        self.assertEqual(down, sorted(set(down), reverse=True))
+        self.assertEqual(down[-1], 0)
+        return up
+
+    def test_steps(self):
+        up = self.check_steps()
+        # Perceptually even: fine steps near the top, coarse near the bottom
+        self.assertEqual(up[-2:], [86, 87])
+        self.assertGreater(up[1] - up[0], 1)
+
+    def test_mute_floor(self):
+        FakeALSAControl.mute_floor = True
+        up = self.check_steps()
+        # Still mapped in dB, not linearly in raw units
+        self.assertEqual(up[-2:], [86, 87])
+        self.assertGreater(up[1] - up[0], 1)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: filetype=python:et:sw=4:ts=4:sts=4:tw=79